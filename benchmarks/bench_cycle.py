@@ -0,0 +1,143 @@
+"""Бенчмарк повного циклу синхронізації з фейковим Monobank API і SMTP-приймачем
+
+Для кожного обсягу вже збережених транзакцій (за замовчуванням 1k/100k/1M)
+створює тимчасову базу, заповнює її обробленими транзакціями і запускає цикли
+так само, як main(): міграції, компіляція фільтрів, run_cycle().
+Окремо вимірюється час етапів: отримання виписок, фільтр, запис, рендеринг і
+відправка листів (час відправки підсумовується по потоках пулу SMTP).
+
+    python benchmarks/bench_cycle.py --stored 1000 100000 1000000 --per-request 200 --rate-limit-every 7
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("SMTP_PORT", "25")
+
+import main
+from fake_monobank import FakeMonobank
+from smtp_sink import SmtpSink
+
+STAGES = [
+    ("fetch", "fetch_statements"),
+    ("filter", "filter_transactions"),
+    ("save", "save_transactions"),
+    ("render", "build_transaction_email"),
+]
+
+def instrument(timings):
+    """Обгорнути функції етапів у main, щоб підсумовувати їхній час"""
+    def timed(stage, func):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - started
+        return wrapper
+
+    for stage, name in STAGES:
+        setattr(main, name, timed(stage, getattr(main, name)))
+    main.SmtpConnection.send = timed("send", main.SmtpConnection.send)
+
+def make_settings(db_file, api, sink, tokens):
+    settings = main.get_settings()
+    settings.update({
+        "db_file": db_file,
+        "api_base_url": api.base_url,
+        "token": tokens[0],
+        "tokens": tokens,
+        "api_delay": 0.001,
+        "client_info_delay": 0.001,
+        "api_backoff": 0,
+        "smtp_server": "127.0.0.1",
+        "smtp_port": sink.port,
+        "smtp_username": "",
+        "smtp_starttls": False,
+        "smtp_sender": "monitor@example.com",
+        "smtp_recipients": ["accountant@example.com"],
+        "notify_mode": "instant",
+        "webhook_url": "",
+        "metrics_file": "",
+        "ignore_senders": ["ФОП Відправник 99"],
+    })
+    return settings
+
+def seed_transactions(settings, api, tokens, stored):
+    """Заповнити базу вже обробленими транзакціями, рівномірно по всіх рахунках"""
+    conn = main.open_db(settings['db_file'])
+    main.create_db(conn)
+    accounts = [a['id'] for token in tokens for a in api.client_info(token)['accounts']]
+    now = int(time.time()) - 86400 * 400
+    batch = 50000
+    for start in range(0, stored, batch):
+        rows = []
+        for n in range(start, min(start + batch, stored)):
+            rows.append((
+                f"seed{n}", accounts[n % len(accounts)], now + n, f"Платіж {n}", 4829,
+                10000 + n, 10000 + n, 980, 1000000, f"ФОП Відправник {n % 1000}", "", "", 1
+            ))
+        conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    conn.close()
+
+def run_main_cycle(settings):
+    """Те саме, що робить main() для одного запуску з cron"""
+    runtime = main.create_runtime(settings)
+    try:
+        main.create_db(runtime['conn'])
+        clients = main.get_client_configs(runtime['conn'])
+        main.precompile_filters(settings, clients)
+        main.run_cycle(runtime)
+    finally:
+        main.close_notifiers()
+        runtime['session'].close()
+        runtime['conn'].close()
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк повного циклу синхронізації")
+    parser.add_argument('--stored', type=int, nargs='+', default=[1000, 100000, 1000000], help="Обсяги збережених транзакцій")
+    parser.add_argument('--clients', type=int, default=2, help="Кількість токенів (клієнтів)")
+    parser.add_argument('--accounts', type=int, default=2, help="Рахунків у кожного клієнта")
+    parser.add_argument('--per-request', type=int, default=100, help="Нових транзакцій у кожній виписці")
+    parser.add_argument('--cycles', type=int, default=2, help="Циклів на кожен обсяг")
+    parser.add_argument('--rate-limit-every', type=int, default=7, help="Відповідь 429 на кожен N-й запит (0 - без 429)")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Затримка відповіді API, секунд")
+    parser.add_argument('--smtp-delay', type=float, default=0.0, help="Затримка підключення до SMTP, секунд")
+    args = parser.parse_args()
+
+    logging.getLogger('monobank_monitor').setLevel(logging.ERROR)
+    timings = defaultdict(float)
+    instrument(timings)
+    tokens = [f"bench-token-{i}" for i in range(args.clients)]
+
+    header = f"{'збережено':>10} {'цикл, с':>8} " + " ".join(f"{stage:>8}" for stage in ("fetch", "filter", "save", "render", "send")) + f" {'листів':>7} {'429':>5}"
+    print(header)
+
+    for stored in args.stored:
+        with tempfile.TemporaryDirectory() as tmp, \
+                FakeMonobank(args.accounts, args.per_request, args.rate_limit_every, latency=args.api_latency) as api, \
+                SmtpSink(connect_delay=args.smtp_delay) as sink:
+            settings = make_settings(os.path.join(tmp, "bench.db"), api, sink, tokens)
+            seed_transactions(settings, api, tokens, stored)
+
+            for cycle in range(args.cycles):
+                timings.clear()
+                sent_before = sink.messages
+                limited_before = api.rate_limited
+                started = time.perf_counter()
+                run_main_cycle(settings)
+                elapsed = time.perf_counter() - started
+
+                stages = " ".join(f"{timings[stage]:>8.3f}" for stage in ("fetch", "filter", "save", "render", "send"))
+                print(f"{stored:>10} {elapsed:>8.3f} {stages} {sink.messages - sent_before:>7} {api.rate_limited - limited_before:>5}")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,91 @@
+"""Бенчмарк фільтрації транзакцій проти тисяч правил
+
+Порівнює попередній лінійний перебір ігнорованих відправників (зі .strip() на
+кожну пару транзакція-шаблон) зі скомпільованим фільтром, що перевіряє
+сторінку виписки одним проходом.
+
+    python benchmarks/bench_filters.py --rules 5000 --count 2000
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+def make_senders(count):
+    return [f" ФОП Контрагент {i:05d} " for i in range(count)]
+
+def make_transactions(count, senders):
+    rng = random.Random(42)
+    transactions = []
+    for i in range(count):
+        # Приблизно кожна десята транзакція від ігнорованого відправника
+        if i % 10 == 0:
+            counter_name = senders[rng.randrange(len(senders))].strip()
+        else:
+            counter_name = f"ТОВ Покупець {rng.randrange(10 ** 6)}"
+        transactions.append({
+            "id": f"tx{i}",
+            "amount": rng.choice([-5000, 10000, 25000]),
+            "mcc": rng.choice([4829, 5411, 6011]),
+            "counterName": counter_name,
+        })
+    return transactions
+
+def legacy_should_process(transaction, ignore_senders):
+    """Попередня реалізація should_process_transaction без логування"""
+    if transaction.get('amount', 0) <= 0:
+        return False
+    counter_name = transaction.get('counterName', '')
+    for ignore_sender in ignore_senders:
+        if ignore_sender.strip() in counter_name:
+            return False
+    return True
+
+def make_settings(senders):
+    return {
+        "ignore_senders": [s.strip() for s in senders],
+        "ignore_mcc": [6011],
+        "min_amount": 0,
+        "max_amount": 0,
+        "filter_rules_file": "",
+    }
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк фільтрації транзакцій")
+    parser.add_argument('--rules', type=int, default=5000, help="Кількість ігнорованих відправників")
+    parser.add_argument('--count', type=int, default=2000, help="Кількість транзакцій")
+    args = parser.parse_args()
+
+    logging.getLogger('monobank_monitor').setLevel(logging.WARNING)
+    senders = make_senders(args.rules)
+    transactions = make_transactions(args.count, senders)
+    settings = make_settings(senders)
+
+    started = time.perf_counter()
+    legacy = [tx for tx in transactions if legacy_should_process(tx, senders)]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    transaction_filter = main.get_transaction_filter(settings)
+    compile_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    qualifying, skipped = transaction_filter.split(transactions)
+    compiled_time = time.perf_counter() - started
+
+    # Скомпільований фільтр додатково відкидає MCC 6011
+    assert all(tx in legacy for tx in qualifying)
+
+    print(f"Правил: {args.rules}, транзакцій: {args.count}")
+    print(f"лінійний перебір       {args.count / legacy_time:>12.0f} транзакцій/с")
+    print(f"скомпільований фільтр  {args.count / compiled_time:>12.0f} транзакцій/с "
+          f"(компіляція {compile_time * 1000:.1f} мс, пропущено {len(skipped)})")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,118 @@
+"""Бенчмарк розсилки в кілька каналів через локальні приймачі
+
+SMTP-приймач і два HTTP-приймачі (вебхук і Telegram Bot API) працюють локально.
+Порівнює послідовну відправку каналами один за одним з одночасною розсилкою
+deliver_transactions() і перевіряє статуси доставки в таблиці deliveries.
+
+    python benchmarks/bench_notify.py --count 200 --smtp-delay 0.05 --http-delay 0.02
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("SMTP_PORT", "25")
+
+import main
+from http_sink import HttpSink
+from smtp_sink import SmtpSink
+
+def make_settings(smtp, webhook, telegram, args):
+    settings = main.get_settings()
+    settings.update({
+        "client_id": None,
+        "smtp_server": "127.0.0.1",
+        "smtp_port": smtp.port,
+        "smtp_username": "",
+        "smtp_starttls": False,
+        "smtp_sender": "monitor@example.com",
+        "smtp_recipients": ["accountant@example.com"],
+        "smtp_pool_size": args.pool,
+        "notify_channels": ["smtp", "webhook", "telegram"],
+        "notify_webhook_url": f"{webhook.base_url}/hook",
+        "notify_webhook_concurrency": args.concurrency,
+        "telegram_api_url": telegram.base_url,
+        "telegram_bot_token": "bench",
+        "telegram_chat_ids": ["1001", "1002"],
+        "telegram_concurrency": args.concurrency,
+    })
+    return settings
+
+def make_items(count, settings):
+    now = int(time.time())
+    return [
+        (
+            {
+                "id": f"tx{i}",
+                "account_id": "acc1",
+                "time": now,
+                "description": f"Платіж {i}",
+                "mcc": 4829,
+                "amount": 10000 + i,
+                "counterName": "ФОП Відправник",
+                "comment": "",
+            },
+            "Клієнт Monobank",
+            settings,
+        )
+        for i in range(count)
+    ]
+
+def bench_sequential(conn, items):
+    """Канали по черзі: кожен наступний чекає, поки закінчиться попередній"""
+    started = time.perf_counter()
+    for notifier in main.get_notifiers(items[0][2]):
+        notifier.send_many(items)
+    return time.perf_counter() - started
+
+def bench_fan_out(conn, items):
+    started = time.perf_counter()
+    errors = main.deliver_transactions(conn, items)
+    elapsed = time.perf_counter() - started
+    failed = [e for e in errors if e is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} повідомлень не доставлено: {failed[0]}")
+    return elapsed
+
+def run(name, bench, items, args):
+    with tempfile.TemporaryDirectory() as tmp, \
+            SmtpSink(connect_delay=args.smtp_delay) as smtp, \
+            HttpSink(delay=args.http_delay) as webhook, \
+            HttpSink(delay=args.http_delay) as telegram:
+        settings = make_settings(smtp, webhook, telegram, args)
+        items = [(tx, client_name, settings) for tx, client_name, _ in items]
+        conn = main.open_db(os.path.join(tmp, "bench.db"))
+        main.create_db(conn)
+        try:
+            elapsed = bench(conn, items)
+            sent = conn.execute("SELECT COUNT(*) FROM deliveries WHERE status = 'sent'").fetchone()[0]
+        finally:
+            main.close_notifiers()
+            conn.close()
+        print(
+            f"{name:<24} {len(items):>6} транзакцій  {elapsed:8.3f} с  "
+            f"листів: {smtp.messages}  вебхук: {webhook.requests}  telegram: {telegram.requests}  статусів: {sent}"
+        )
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк розсилки в кілька каналів")
+    parser.add_argument("--count", type=int, default=200, help="кількість транзакцій")
+    parser.add_argument("--smtp-delay", type=float, default=0.05, help="імітація TLS і логіну SMTP, секунд")
+    parser.add_argument("--http-delay", type=float, default=0.02, help="затримка відповіді HTTP-приймачів, секунд")
+    parser.add_argument("--pool", type=int, default=2, help="розмір пулу SMTP-з'єднань")
+    parser.add_argument("--concurrency", type=int, default=4, help="паралельність кожного HTTP-каналу")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    items = make_items(args.count, None)
+    run("канали по черзі", bench_sequential, items, args)
+    run("одночасна розсилка", bench_fan_out, items, args)
+
+if __name__ == "__main__":
+    main_bench()
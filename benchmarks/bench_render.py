@@ -0,0 +1,76 @@
+"""Бенчмарк рендерингу листів зі скомпільованих шаблонів
+
+Вимірює кількість рендерів за секунду для листа про одну транзакцію і для
+зведення, а також повну побудову MIME-повідомлення з текстовою версією.
+
+    python benchmarks/bench_render.py --count 2000 --digest-size 50
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+def make_settings():
+    return {
+        "smtp_sender": "monitor@example.com",
+        "smtp_recipients": ["accountant@example.com"],
+        "templates_dir": str(Path(__file__).resolve().parent.parent / "templates"),
+    }
+
+def make_transactions(count):
+    now = int(time.time())
+    return [
+        {
+            "id": f"tx{i}",
+            "account_id": f"acc{i % 3}",
+            "iban": f"UA00000000000000000000000{i % 3}",
+            "time": now - i * 60,
+            "description": f"Платіж <{i}> & Co",
+            "mcc": 4829,
+            "amount": 10000 + i,
+            "counterName": "ФОП Відправник",
+            "comment": "Оплата за рахунком" if i % 2 else "",
+        }
+        for i in range(count)
+    ]
+
+def bench(label, count, func):
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {count / elapsed:>10.0f} /с")
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк рендерингу шаблонів листів")
+    parser.add_argument('--count', type=int, default=2000, help="Кількість рендерів на сценарій")
+    parser.add_argument('--digest-size', type=int, default=50, help="Транзакцій у зведенні")
+    args = parser.parse_args()
+
+    logging.getLogger('monobank_monitor').setLevel(logging.WARNING)
+    settings = make_settings()
+
+    started = time.perf_counter()
+    main.precompile_templates(settings)
+    print(f"Компіляція шаблонів: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    transactions = make_transactions(max(args.count, args.digest_size))
+    tx_iter = iter(transactions * 2)
+    digest = transactions[:args.digest_size]
+
+    bench("render transaction", args.count,
+          lambda: main.render_email(settings, "transaction", tx=next(tx_iter), client_name="Клієнт"))
+    bench("build_transaction_email", args.count,
+          lambda: main.build_transaction_email(transactions[0], "Клієнт", settings))
+    bench(f"render digest ({args.digest_size})", max(args.count // 10, 1),
+          lambda: main.render_email(settings, "digest", transactions=digest, accounts=[], total=0, client_name="Клієнт"))
+    bench(f"build_digest_email ({args.digest_size})", max(args.count // 10, 1),
+          lambda: main.build_digest_email(digest, "Клієнт", settings))
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,107 @@
+"""Бенчмарк відправки листів через локальний SMTP-приймач
+
+Порівнює нове з'єднання на кожен лист (як було раніше) з повторно використаним
+з'єднанням і пулом паралельних з'єднань.
+
+    python benchmarks/bench_smtp.py --count 300 --connect-delay 0.05 --pool 4
+"""
+import argparse
+import logging
+import smtplib
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+from smtp_sink import SmtpSink
+
+def make_settings(port, pool_size):
+    return {
+        "smtp_server": "127.0.0.1",
+        "smtp_port": port,
+        "smtp_username": "bench",
+        "smtp_password": "bench",
+        "smtp_sender": "monitor@example.com",
+        "smtp_recipients": ["accountant@example.com"],
+        "smtp_starttls": False,
+        "smtp_timeout": 10,
+        "smtp_pool_size": pool_size,
+        "smtp_max_messages": 100,
+        "templates_dir": str(Path(__file__).resolve().parent.parent / "templates"),
+    }
+
+def make_messages(count, settings):
+    return [
+        main.build_transaction_email(
+            {
+                "id": f"tx{i}",
+                "time": int(time.time()),
+                "description": f"Платіж {i}",
+                "mcc": 4829,
+                "amount": 10000 + i,
+                "counterName": "ФОП Відправник",
+                "comment": "",
+            },
+            "Клієнт Monobank",
+            settings
+        )
+        for i in range(count)
+    ]
+
+def bench_connection_per_message(settings, messages):
+    started = time.perf_counter()
+    for msg in messages:
+        server = smtplib.SMTP(settings['smtp_server'], settings['smtp_port'])
+        server.login(settings['smtp_username'], settings['smtp_password'])
+        server.send_message(msg)
+        server.quit()
+    return time.perf_counter() - started
+
+def bench_reused_connection(settings, messages):
+    connection = main.SmtpConnection(settings)
+    started = time.perf_counter()
+    for msg in messages:
+        connection.send(msg)
+    connection.close()
+    return time.perf_counter() - started
+
+def bench_pool(settings, messages):
+    pool = main.SmtpPool(settings, settings['smtp_pool_size'])
+    started = time.perf_counter()
+    errors = pool.send_many(messages)
+    elapsed = time.perf_counter() - started
+    pool.close()
+    failed = [e for e in errors if e is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} листів не відправлено: {failed[0]}")
+    return elapsed
+
+def run(name, bench, settings, messages, connect_delay):
+    with SmtpSink(connect_delay=connect_delay) as sink:
+        settings = dict(settings, smtp_port=sink.port)
+        elapsed = bench(settings, messages)
+        print(
+            f"{name:<28} {len(messages):>6} листів  {elapsed:8.3f} с  "
+            f"{len(messages) / elapsed:10.1f} листів/с  з'єднань: {sink.connections}"
+        )
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк відправки листів")
+    parser.add_argument("--count", type=int, default=300, help="кількість листів")
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="імітація TLS і логіну, секунд")
+    parser.add_argument("--pool", type=int, default=4, help="розмір пулу з'єднань")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    settings = make_settings(0, args.pool)
+    messages = make_messages(args.count, settings)
+
+    run("з'єднання на кожен лист", bench_connection_per_message, settings, messages, args.connect_delay)
+    run("одне з'єднання", bench_reused_connection, settings, messages, args.connect_delay)
+    run(f"пул з {args.pool} з'єднань", bench_pool, settings, messages, args.connect_delay)
+
+if __name__ == "__main__":
+    main_bench()
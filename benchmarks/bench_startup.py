@@ -0,0 +1,119 @@
+"""Бенчмарк холодного старту разового запуску з cron
+
+Запускає `python -X importtime main.py` в окремому процесі проти фейкового Monobank
+API без нових транзакцій: перший запуск створює базу і кеш клієнта, наступні - звичайні
+холості цикли з cron. Для кожного запуску виводить повний час процесу і час імпортів,
+для останнього - найдорожчі модулі. Перевіряє, що холостий цикл не завантажує модулі,
+потрібні лише для відправки (SMTP, MIME, шаблони, asyncio), і що медіана часу
+холостого запуску вкладається в бюджет; інакше завершується з кодом 1.
+
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 250
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_monobank import FakeMonobank
+
+ROOT = Path(__file__).resolve().parent.parent
+MAIN = ROOT / "main.py"
+
+# Модулі, яких не має бути в процесі, що нічого не відправляє
+LAZY_MODULES = ["smtplib", "email.mime", "jinja2", "asyncio", "colorlog", "concurrent.futures"]
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+def make_env(api, tmp):
+    env = dict(os.environ)
+    env.update({
+        "MONO_API_TOKEN": "bench-token",
+        "MONO_API_TOKENS": "",
+        "MONO_API_BASE_URL": api.base_url,
+        "DB_FILE": os.path.join(tmp, "bench.db"),
+        "TEMPLATES_DIR": str(ROOT / "templates"),
+        "API_DELAY": "1",
+        "CLIENT_INFO_DELAY": "1",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": "25",
+        "NOTIFY_CHANNELS": "smtp",
+        "NOTIFY_MODE": "instant",
+        "MAINTENANCE_INTERVAL": "0",
+        "METRICS_FILE": "",
+        "LOG_MODE": "summary",
+    })
+    return env
+
+def parse_importtime(stderr):
+    """Час імпортів верхнього рівня і множина всіх завантажених модулів"""
+    top_level = {}
+    loaded = set()
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        loaded.add(name)
+        if not indent:
+            top_level[name] = cumulative
+    return top_level, loaded
+
+def run_once(env, tmp):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MAIN)],
+        cwd=tmp, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"main.py завершився з кодом {result.returncode}:\n{result.stderr[-2000:]}")
+    top_level, loaded = parse_importtime(result.stderr)
+    return elapsed, top_level, loaded
+
+def is_loaded(module, loaded):
+    return any(name == module or name.startswith(module + ".") for name in loaded)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старту разового запуску")
+    parser.add_argument("--runs", type=int, default=5, help="холостих запусків після першого")
+    parser.add_argument("--budget-ms", type=float, default=250, help="бюджет медіани часу холостого запуску, мс")
+    parser.add_argument("--top", type=int, default=10, help="скільки найдорожчих імпортів показати")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeMonobank(accounts=1, per_request=0) as api:
+        env = make_env(api, tmp)
+
+        print(f"{'запуск':<10} {'процес, мс':>11} {'імпорти, мс':>12}")
+        elapsed, top_level, _ = run_once(env, tmp)
+        print(f"{'перший':<10} {elapsed * 1000:>11.1f} {sum(top_level.values()) / 1000:>12.1f}")
+
+        timings = []
+        for run in range(args.runs):
+            elapsed, top_level, loaded = run_once(env, tmp)
+            timings.append(elapsed * 1000)
+            print(f"{f'холостий {run + 1}':<10} {elapsed * 1000:>11.1f} {sum(top_level.values()) / 1000:>12.1f}")
+
+    print("\nНайдорожчі імпорти останнього запуску (мс, разом із залежностями):")
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28} {cumulative / 1000:>8.1f}")
+
+    failures = []
+    eager = [module for module in LAZY_MODULES if is_loaded(module, loaded)]
+    if eager:
+        failures.append(f"холостий запуск завантажив {', '.join(eager)}")
+    median = statistics.median(timings)
+    print(f"\nМедіана холостого запуску: {median:.1f} мс (бюджет {args.budget_ms:.0f} мс)")
+    if median > args.budget_ms:
+        failures.append(f"медіана {median:.1f} мс перевищує бюджет {args.budget_ms:.0f} мс")
+
+    for failure in failures:
+        print(f"ПОМИЛКА: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,108 @@
+"""Бенчмарк запису транзакцій у SQLite
+
+Порівнює старий підхід (нове з'єднання, SELECT і INSERT на кожну транзакцію)
+з пакетним записом сторінки виписки через save_transactions().
+
+    python benchmarks/bench_storage.py --count 20000 --page 500
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+def make_transactions(count, prefix):
+    """Синтетичні транзакції у форматі StatementItem"""
+    start = int(time.time()) - count
+    return [
+        {
+            "id": f"{prefix}{i}",
+            "time": start + i,
+            "description": f"Платіж {i}",
+            "mcc": 4829,
+            "amount": 10000 + i,
+            "operationAmount": 10000 + i,
+            "currencyCode": 980,
+            "balance": 1000000 + i,
+            "counterName": f"ФОП Відправник {i % 100}",
+            "comment": "",
+        }
+        for i in range(count)
+    ]
+
+def legacy_save_transaction(db_file, account_id, transaction):
+    """Запис однієї транзакції так, як це робилось до пакетного запису"""
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.execute("SELECT processed FROM transactions WHERE id = ?", (transaction['id'],))
+    if not c.fetchone():
+        c.execute(
+            "INSERT INTO transactions (id, account_id, time, description, mcc, amount, operation_amount, "
+            "currency_code, balance, counter_name, comment, created_at, processed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+            (
+                transaction['id'], account_id, transaction['time'], transaction['description'],
+                transaction['mcc'], transaction['amount'], transaction['operationAmount'],
+                transaction['currencyCode'], transaction['balance'], transaction['counterName'],
+                transaction['comment'], ""
+            )
+        )
+    conn.commit()
+    conn.close()
+
+def bench_legacy(db_file, transactions):
+    started = time.perf_counter()
+    for tx in transactions:
+        legacy_save_transaction(db_file, "bench-account", tx)
+    return time.perf_counter() - started
+
+def bench_batch(db_file, transactions, page):
+    conn = main.open_db(db_file)
+    started = time.perf_counter()
+    for offset in range(0, len(transactions), page):
+        main.save_transactions(conn, "bench-account", transactions[offset:offset + page])
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed
+
+def report(name, count, elapsed):
+    print(f"{name:<32} {count:>8} рядків  {elapsed:8.3f} с  {count / elapsed:12,.0f} рядків/с")
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Бенчмарк запису транзакцій у SQLite")
+    parser.add_argument("--count", type=int, default=20000, help="кількість транзакцій")
+    parser.add_argument("--page", type=int, default=500, help="розмір сторінки виписки")
+    parser.add_argument("--skip-legacy", action="store_true", help="не запускати повільний старий підхід")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        batch_db = os.path.join(tmp, "batch.db")
+        for db_file in (legacy_db, batch_db):
+            conn = main.open_db(db_file)
+            main.create_db(conn)
+            conn.close()
+
+        # Старий підхід працював у режимі журналу за замовчуванням
+        conn = sqlite3.connect(legacy_db)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+        transactions = make_transactions(args.count, "tx")
+
+        if not args.skip_legacy:
+            report("по одній (legacy)", args.count, bench_legacy(legacy_db, transactions))
+        report(f"пакетами по {args.page} (нові)", args.count, bench_batch(batch_db, transactions, args.page))
+        report(f"пакетами по {args.page} (повтор)", args.count, bench_batch(batch_db, transactions, args.page))
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,167 @@
+"""Локальна заміна Monobank API для бенчмарків
+
+Відповідає на /personal/client-info, /personal/statement/{account}/{from}/{to} і
+/personal/webhook. Кожен токен - окремий клієнт з accounts рахунками, кожен запит
+виписки повертає per_request нових синтетичних транзакцій (не більше 500, як у
+справжньому API). history=N замість цього дає кожному рахунку N фіксованих транзакцій
+за останні history_days днів, і виписка повертає до 500 найновіших у вікні запиту,
+як справжній API. rate_limit_every=N повертає 429 на кожен N-й запит, latency
+додає затримку до кожної відповіді.
+"""
+import http.server
+import json
+import threading
+import time
+import zlib
+
+class FakeMonobankHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, payload=None, headers=None):
+        body = json.dumps(payload if payload is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        api = self.server.api
+        if self.command == "POST":
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if api.latency:
+            time.sleep(api.latency)
+
+        with api.lock:
+            api.requests += 1
+            limited = api.rate_limit_every and api.requests % api.rate_limit_every == 0
+            if limited:
+                api.rate_limited += 1
+        if limited:
+            self.respond(429, {"errorDescription": "Too many requests"}, {"Retry-After": str(api.retry_after)})
+            return
+
+        token = self.headers.get("X-Token", "")
+        path = self.path.split("?")[0]
+        if path == "/personal/client-info":
+            self.respond(200, api.client_info(token))
+        elif path.startswith("/personal/statement/"):
+            account_id, from_ts, to_ts = path.rsplit("/", 3)[1:]
+            self.respond(200, api.statement(account_id, int(from_ts), int(to_ts)))
+        elif path == "/personal/webhook":
+            self.respond(200, {"status": "ok"})
+        else:
+            self.respond(404, {"errorDescription": "Unknown method"})
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+class ThreadedHttpServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class FakeMonobank:
+    """Фейковий Monobank API у фоновому потоці на вільному локальному порту"""
+
+    def __init__(self, accounts=2, per_request=100, rate_limit_every=0, retry_after=0, latency=0.0,
+                 history=0, history_days=365):
+        self.accounts = accounts
+        self.per_request = min(per_request, 500)
+        self.history = history
+        self.history_days = history_days
+        self.history_end = int(time.time())
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.requests = 0
+        self.rate_limited = 0
+        self.generated = 0
+        self.lock = threading.Lock()
+        self.server = ThreadedHttpServer(("127.0.0.1", 0), FakeMonobankHandler)
+        self.server.api = self
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def client_id(self, token):
+        return f"client{zlib.crc32(token.encode()):08x}"
+
+    def client_info(self, token):
+        client_id = self.client_id(token)
+        return {
+            "clientId": client_id,
+            "name": f"Клієнт {client_id}",
+            "webHookUrl": "",
+            "permissions": "psfj",
+            "accounts": [
+                {
+                    "id": f"{client_id}-acc{i}",
+                    "sendId": f"send{i}",
+                    "balance": 1000000,
+                    "creditLimit": 0,
+                    "type": "black",
+                    "currencyCode": 980,
+                    "iban": f"UA{zlib.crc32(f'{client_id}{i}'.encode()):027d}",
+                }
+                for i in range(self.accounts)
+            ],
+        }
+
+    def history_item(self, account_id, n):
+        # n=0 - найновіша транзакція, кілька транзакцій можуть мати ту саму секунду
+        span = self.history_days * 86400
+        return self.make_item(account_id, n, self.history_end - (n * span) // self.history)
+
+    def statement(self, account_id, from_ts, to_ts):
+        if self.history:
+            # Індекси транзакцій історії, що потрапляють у вікно (час спадає з ростом n)
+            span = self.history_days * 86400
+            first = max(0, (self.history_end - to_ts) * self.history // span - 1)
+            items = []
+            for n in range(first, self.history):
+                item = self.history_item(account_id, n)
+                if item["time"] > to_ts:
+                    continue
+                if item["time"] < from_ts or len(items) == 500:
+                    break
+                items.append(item)
+            return items
+
+        with self.lock:
+            start = self.generated
+            self.generated += self.per_request
+        span = max(to_ts - from_ts, 1)
+        # Виписка впорядкована від нових до старих, як у справжньому API
+        return [
+            self.make_item(account_id, n, to_ts - (i * span) // self.per_request)
+            for i, n in enumerate(range(start, start + self.per_request))
+        ]
+
+    def make_item(self, account_id, n, tx_time):
+        return {
+            "id": f"{account_id}-tx{n}",
+            "time": tx_time,
+            "description": f"Платіж {n}",
+            "mcc": (4829, 5411, 6011)[n % 3],
+            "originalMcc": 4829,
+            "amount": (10000 + n) if n % 4 else -(5000 + n),
+            "operationAmount": 10000 + n,
+            "currencyCode": 980,
+            "commissionRate": 0,
+            "cashbackAmount": 0,
+            "balance": 1000000 + n,
+            "hold": False,
+            "counterName": f"ФОП Відправник {n % 1000}",
+            "comment": "Оплата" if n % 2 else "",
+        }
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
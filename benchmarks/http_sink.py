@@ -0,0 +1,59 @@
+"""Локальний HTTP-приймач для бенчмарків каналів повідомлень
+
+Приймає будь-який POST (вебхук, Slack, Telegram sendMessage), рахує запити по
+шляхах і відповідає {"ok": true}. Затримка delay імітує повільний приймач,
+fail_every - відповідь 500 на кожен N-й запит.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class HttpSinkHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        sink = self.server.sink
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if sink.delay:
+            time.sleep(sink.delay)
+
+        with sink.lock:
+            sink.requests += 1
+            failed = bool(sink.fail_every) and sink.requests % sink.fail_every == 0
+            if not failed:
+                sink.paths[self.path] += 1
+                sink.payloads.append(json.loads(body or b"null"))
+
+        payload = json.dumps({"ok": not failed}).encode()
+        self.send_response(500 if failed else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class HttpSink:
+    """HTTP-приймач у фоновому потоці на вільному локальному порту"""
+
+    def __init__(self, delay=0.0, fail_every=0):
+        self.delay = delay
+        self.fail_every = fail_every
+        self.requests = 0
+        self.paths = Counter()
+        self.payloads = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), HttpSinkHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
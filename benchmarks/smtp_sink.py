@@ -0,0 +1,78 @@
+"""Локальний SMTP-приймач для бенчмарків
+
+Розуміє мінімальний діалог EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT і
+лише рахує отримані листи. Затримка connect_delay імітує TLS-рукостискання та
+автентифікацію справжнього сервера, fail_every - обрив з'єднання після N листів.
+"""
+import socketserver
+import threading
+import time
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        if sink.connect_delay:
+            time.sleep(sink.connect_delay)
+        self.reply("220 smtp-sink ready")
+
+        received = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+
+            if command.startswith(("EHLO", "HELO")):
+                self.wfile.write(b"250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                self.wfile.flush()
+            elif command.startswith("AUTH"):
+                self.reply("235 authenticated")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                received += 1
+                with sink.lock:
+                    sink.messages += 1
+                self.reply("250 queued")
+                if sink.fail_every and received >= sink.fail_every:
+                    return
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+class ThreadedSmtpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SmtpSink:
+    """SMTP-приймач у фоновому потоці на вільному локальному порту"""
+
+    def __init__(self, connect_delay=0.0, fail_every=0):
+        self.connect_delay = connect_delay
+        self.fail_every = fail_every
+        self.connections = 0
+        self.messages = 0
+        self.lock = threading.Lock()
+        self.server = ThreadedSmtpServer(("127.0.0.1", 0), SmtpSinkHandler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
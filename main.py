@@ -1,52 +1,75 @@
 import sqlite3
 import json
 import os
-import requests
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from datetime import datetime, timedelta, timezone
 import time
 import logging
 import logging.handlers
-import colorlog
+import argparse
+import signal
+import threading
+import random
+import hashlib
+import re
+import queue
+import socket
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from pathlib import Path
 
+# requests, smtplib, email, asyncio, jinja2 та інші важкі модулі імпортуються у функціях,
+# що їх використовують: запуск з cron, який нічого не відправляє, їх не завантажує
+
 # Завантаження змінних середовища з .env файлу
 load_dotenv()
 
 # Створюємо константу для Київського часового поясу (UTC+3)
 KYIV_TZ = timezone(timedelta(hours=3))
 
+logger = logging.getLogger('monobank_monitor')
+
 # Налаштування кольорових логів
-def setup_logging():
+# Позначка підсумкових повідомлень, що лишаються в режимі LOG_MODE=summary
+SUMMARY = {"summary": True}
+
+class SummaryFilter(logging.Filter):
+    """Пропускає лише підсумки циклів, попередження і помилки"""
+    
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or getattr(record, 'summary', False)
+
+def setup_logging(settings):
+    """Обробники логів працюють у фоновому потоці, основний лише ставить записи в чергу"""
     # Створюємо папку для логів, якщо її не існує
     logs_dir = Path("logs")
     logs_dir.mkdir(exist_ok=True)
     
-    # Створюємо форматтер з кольорами для консолі
-    console_formatter = colorlog.ColoredFormatter(
-        "%(log_color)s%(asctime)s - %(levelname)s - %(message)s",
-        datefmt='%Y-%m-%d %H:%M:%S',
-        log_colors={
-            'DEBUG': 'cyan',
-            'INFO': 'green',
-            'WARNING': 'yellow',
-            'ERROR': 'red',
-            'CRITICAL': 'red,bg_white',
-        }
-    )
-    
     # Форматтер для файлових логів (без кольорів)
     file_formatter = logging.Formatter(
         "%(asctime)s - %(levelname)s - %(message)s",
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     
-    # Обробник для консолі
+    # Обробник для консолі; кольори лише в терміналі, під cron вивід іде в пошту або файл
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(console_formatter)
+    if console_handler.stream.isatty():
+        import colorlog
+        
+        console_handler.setFormatter(colorlog.ColoredFormatter(
+            "%(log_color)s%(asctime)s - %(levelname)s - %(message)s",
+            datefmt='%Y-%m-%d %H:%M:%S',
+            log_colors={
+                'DEBUG': 'cyan',
+                'INFO': 'green',
+                'WARNING': 'yellow',
+                'ERROR': 'red',
+                'CRITICAL': 'red,bg_white',
+            }
+        ))
+    else:
+        console_handler.setFormatter(file_formatter)
     
     # Обробник для файлів з ротацією за датою
     today = datetime.now(KYIV_TZ).strftime('%Y-%m-%d')
@@ -59,21 +82,28 @@ def setup_logging():
     )
     file_handler.setFormatter(file_formatter)
     
+    # Запис у файл і на консоль виконує QueueListener в окремому потоці
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    if settings['log_mode'] == 'summary':
+        queue_handler.addFilter(SummaryFilter())
+    listener = logging.handlers.QueueListener(queue_handler.queue, console_handler, file_handler)
+    listener.start()
+    
     # Налаштування корневого логгера
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
+    root_logger.setLevel(settings['log_level'])
+    root_logger.addHandler(queue_handler)
     
-    # Повертаємо наш логгер
-    logger = logging.getLogger('monobank_monitor')
-    return logger
+    # Повертаємо слухача, щоб дописати чергу перед виходом
+    return listener
 
 # Отримуємо налаштування з .env файлу
 def get_settings():
     return {
         # Monobank API
         "token": os.getenv("MONO_API_TOKEN", "uiB-kwhXL_tmxdQFbvhtp8AQ3uzqq_o8fbMOJNXqqfLo"),
+        "token_configured": bool(os.getenv("MONO_API_TOKEN")),
+        "tokens": [t.strip() for t in os.getenv("MONO_API_TOKENS", "").split(',') if t.strip()],
         "api_base_url": os.getenv("MONO_API_BASE_URL", "https://api.monobank.ua"),
         
         # Налаштування SMTP
@@ -83,18 +113,251 @@ def get_settings():
         "smtp_password": os.getenv("SMTP_PASSWORD", ""),
         "smtp_sender": os.getenv("SMTP_SENDER", ""),
         "smtp_recipients": os.getenv("SMTP_RECIPIENTS", "").split(','),
+        "smtp_starttls": os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+        "smtp_timeout": int(os.getenv("SMTP_TIMEOUT", "30")),
+        "smtp_pool_size": int(os.getenv("SMTP_POOL_SIZE", "2")),
+        "smtp_max_messages": int(os.getenv("SMTP_MAX_MESSAGES", "100")),
+        
+        # Канали повідомлень: smtp, webhook, telegram (через кому)
+        "notify_channels": [c.strip() for c in os.getenv("NOTIFY_CHANNELS", "smtp").split(',') if c.strip()],
+        "notify_http_timeout": int(os.getenv("NOTIFY_HTTP_TIMEOUT", "10")),
+        "notify_webhook_url": os.getenv("NOTIFY_WEBHOOK_URL", ""),
+        "notify_webhook_format": os.getenv("NOTIFY_WEBHOOK_FORMAT", "json"),
+        "notify_webhook_concurrency": int(os.getenv("NOTIFY_WEBHOOK_CONCURRENCY", "4")),
+        "telegram_api_url": os.getenv("TELEGRAM_API_URL", "https://api.telegram.org"),
+        "telegram_bot_token": os.getenv("TELEGRAM_BOT_TOKEN", ""),
+        "telegram_chat_ids": [c.strip() for c in os.getenv("TELEGRAM_CHAT_IDS", "").split(',') if c.strip()],
+        "telegram_concurrency": int(os.getenv("TELEGRAM_CONCURRENCY", "4")),
+        
+        # Повтори невдалих відправок: експоненційна затримка з джитером, після max - dead-letter
+        "retry_backoff": int(os.getenv("RETRY_BACKOFF", "60")),
+        "retry_max_delay": int(os.getenv("RETRY_MAX_DELAY", "21600")),
+        "retry_max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", "8")),
+        
+        # Оренда циклу синхронізації (один процес за раз) і захоплення транзакцій перед відправкою, секунд
+        "sync_lease_ttl": int(os.getenv("SYNC_LEASE_TTL", "900")),
+        "claim_lease": int(os.getenv("CLAIM_LEASE", "600")),
         
         # Інші налаштування
         "days_to_fetch": int(os.getenv("DAYS_TO_FETCH", "2")),
         "api_delay": int(os.getenv("API_DELAY", "61")),
+        "client_info_delay": int(os.getenv("CLIENT_INFO_DELAY", "61")),
+        "api_max_retries": int(os.getenv("API_MAX_RETRIES", "3")),
+        "api_backoff": int(os.getenv("API_BACKOFF", "10")),
         "db_file": os.getenv("DB_FILE", "monobank_data.db"),
+        "poll_interval": int(os.getenv("POLL_INTERVAL", "60")),
+        "sync_overlap": int(os.getenv("SYNC_OVERLAP", "600")),
+        "client_info_ttl": int(os.getenv("CLIENT_INFO_TTL", "3600")),
+        
+        # Зберігання: оброблені транзакції старші за RETENTION_DAYS переносяться в архів (0 - не архівувати)
+        "retention_days": int(os.getenv("RETENTION_DAYS", "0")),
+        "archive_dir": os.getenv("ARCHIVE_DIR", "archive"),
+        "maintenance_interval": int(os.getenv("MAINTENANCE_INTERVAL", "86400")),
+        
+        # Вебхук
+        "webhook_url": os.getenv("WEBHOOK_URL", ""),
+        "webhook_host": os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        "webhook_port": int(os.getenv("WEBHOOK_PORT", "8000")),
+        "webhook_path": os.getenv("WEBHOOK_PATH", "/monobank/webhook"),
+        "reconcile_interval": int(os.getenv("RECONCILE_INTERVAL", "3600")),
+        
+        # Повідомлення: instant - лист на кожну транзакцію, digest - зведення
+        "notify_mode": os.getenv("NOTIFY_MODE", "instant"),
+        "digest_window": int(os.getenv("DIGEST_WINDOW", "3600")),
+        "digest_max_items": int(os.getenv("DIGEST_MAX_ITEMS", "50")),
+        "digest_group_by": os.getenv("DIGEST_GROUP_BY", "client"),
+        
+        # Асинхронний конвеєр (--daemon --async)
+        "pipeline_queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", "100")),
+        "notify_workers": int(os.getenv("NOTIFY_WORKERS", "4")),
+        
+        # Шаблони листів (перевизначення клієнтів у templates/clients/<client_id>/)
+        "templates_dir": os.getenv("TEMPLATES_DIR", str(Path(__file__).parent / "templates")),
+        
+        # Логування: LOG_LEVEL=DEBUG показує кожну транзакцію, LOG_MODE=summary - лише підсумки
+        "log_level": os.getenv("LOG_LEVEL", "INFO").upper(),
+        "log_mode": os.getenv("LOG_MODE", "full"),
+        
+        # Метрики: /metrics у режимі демона (0 - вимкнено) і файл для textfile-колектора
+        "metrics_host": os.getenv("METRICS_HOST", "0.0.0.0"),
+        "metrics_port": int(os.getenv("METRICS_PORT", "0")),
+        "metrics_file": os.getenv("METRICS_FILE", ""),
         
         # Фільтри
-        "ignore_senders": os.getenv("IGNORE_SENDERS", "").split(','),
+        "ignore_senders": [s.strip() for s in os.getenv("IGNORE_SENDERS", "").split(',') if s.strip()],
+        "ignore_mcc": [int(m) for m in os.getenv("IGNORE_MCC", "").split(',') if m.strip()],
+        "min_amount": float(os.getenv("MIN_AMOUNT", "0")),
+        "max_amount": float(os.getenv("MAX_AMOUNT", "0")),
+        "filter_rules_file": os.getenv("FILTER_RULES_FILE", ""),
+        
+        # Токен для GET /reports на сервері вебхука (порожній - звіти лише з командного рядка)
+        "reports_token": os.getenv("REPORTS_TOKEN", ""),
+        
+        # Експорт у колонкові файли (python main.py export): parquet або arrow (Arrow IPC)
+        "export_dir": os.getenv("EXPORT_DIR", "export"),
+        "export_format": os.getenv("EXPORT_FORMAT", "parquet"),
+        "export_chunk_size": int(os.getenv("EXPORT_CHUNK_SIZE", "50000")),
     }
 
-def create_db(db_file):
-    conn = sqlite3.connect(db_file)
+# Межі гістограм: тривалість операцій і затримка від транзакції до листа, секунд
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DELIVERY_BUCKETS = (10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+class Metrics:
+    """Лічильники, показники і гістограми у текстовому форматі Prometheus"""
+    
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.definitions = {}
+        self.values = {}
+    
+    def define(self, name, kind, help_text, buckets=None):
+        self.definitions[name] = (kind, help_text, buckets)
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """Записати тривалість блоку в гістограму"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def render(self):
+        """Усі метрики у форматі text/plain; version=0.0.4"""
+        with self.lock:
+            values = {key: (value[:] if isinstance(value, list) else value) for key, value in self.values.items()}
+        
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for (value_name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if value_name != name:
+                    continue
+                if kind == 'histogram':
+                    counts, total, count = value
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{full_name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{full_name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{full_name}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{full_name}_count{format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{full_name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+metrics = Metrics('monomonitor')
+metrics.define('api_request_seconds', 'histogram', "Тривалість запитів до Monobank API", DURATION_BUCKETS)
+metrics.define('api_rate_limited_total', 'counter', "Відповіді 429 від Monobank API")
+metrics.define('api_retries_total', 'counter', "Повторні запити до Monobank API")
+metrics.define('db_write_seconds', 'histogram', "Тривалість записів у базу", DURATION_BUCKETS)
+metrics.define('smtp_send_seconds', 'histogram', "Тривалість відправки одного листа", DURATION_BUCKETS)
+metrics.define('smtp_reconnects_total', 'counter', "Перепідключення до SMTP після обриву з'єднання")
+metrics.define('delivery_latency_seconds', 'histogram', "Час від транзакції до відправки листа", DELIVERY_BUCKETS)
+metrics.define('emails_total', 'counter', "Відправлені листи за результатом")
+metrics.define('notifications_total', 'counter', "Доставки в канали повідомлень за результатом")
+metrics.define('notify_send_seconds', 'histogram', "Тривалість відправки в HTTP-канал", DURATION_BUCKETS)
+metrics.define('transactions_total', 'counter', "Транзакції з виписок за результатом обробки")
+metrics.define('statements_unchanged_total', 'counter', "Виписки, що не змінились з попереднього опитування")
+metrics.define('outbox_pending', 'gauge', "Транзакції в outbox, що чекають на відправку")
+metrics.define('outbox_dead', 'gauge', "Транзакції в dead-letter після вичерпання спроб")
+metrics.define('notifications_dead_total', 'counter', "Повідомлення, перенесені в dead-letter")
+metrics.define('cycle_seconds', 'histogram', "Тривалість циклу синхронізації", DURATION_BUCKETS)
+metrics.define('last_cycle_timestamp_seconds', 'gauge', "Час завершення останнього циклу")
+metrics.define('db_size_bytes', 'gauge', "Розмір файлу бази без WAL")
+metrics.define('transactions_archived_total', 'counter', "Транзакції, перенесені в місячні архіви")
+
+def observe_delivery(transactions):
+    """Затримка від часу транзакції в банку до відправки листа"""
+    now_ts = time.time()
+    for tx in transactions:
+        if tx.get('time'):
+            metrics.observe('delivery_latency_seconds', max(0, now_ts - tx['time']))
+
+def start_metrics_server(host, port):
+    """HTTP-сервер /metrics у фоновому потоці"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Метрики доступні на http://{host}:{port}/metrics")
+    return server
+
+def write_metrics_file(path):
+    """Записати метрики для textfile-колектора node_exporter (атомарно, через тимчасовий файл)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+def open_db(db_file):
+    """Відкрити з'єднання з базою, яке живе весь час роботи процесу"""
+    conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    
+    # WAL дозволяє читати під час запису (вебхук і звірка), а NORMAL в WAL
+    # не робить fsync на кожен коміт і при цьому не втрачає цілісність бази
+    # Для нової бази: вільні сторінки повертаються файловій системі через incremental_vacuum
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 30000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")
+    return conn
+
+def ensure_column(conn, table, column, definition):
+    """Додати колонку до існуючої таблиці, якщо її ще немає"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def migrate_initial_schema(conn):
+    """Версія 1: таблиці, що існували до появи міграцій (безпечно для старих баз)"""
     c = conn.cursor()
     
     # Таблиця клієнтів
@@ -145,16 +408,354 @@ def create_db(db_file):
     )
     ''')
     
-    conn.commit()
-    conn.close()
-    logger.info("База даних ініціалізована або підтверджена")
+    # Курсор синхронізації для кожного рахунку
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS sync_cursors (
+        account_id TEXT PRIMARY KEY,
+        last_time INTEGER,
+        boundary_ids TEXT,
+        synced_to INTEGER,
+        updated_at TEXT,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+    
+    # Налаштування клієнтів для мультитенантного режиму (NULL - глобальні з .env)
+    ensure_column(conn, 'clients', 'token', 'TEXT')
+    ensure_column(conn, 'clients', 'recipients', 'TEXT')
+    ensure_column(conn, 'clients', 'ignore_senders', 'TEXT')
+
+def migrate_indexes_and_outbox(conn):
+    """Версія 2: індекси для гарячих запитів і черга повідомлень до відправки"""
+    c = conn.cursor()
+    
+    c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_time ON transactions (account_id, time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_unprocessed ON transactions (time) WHERE processed = 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_accounts_client ON accounts (client_id)")
+    
+    # Черга містить лише транзакції, про які ще треба повідомити
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        transaction_id TEXT PRIMARY KEY,
+        account_id TEXT,
+        created_at TEXT,
+        FOREIGN KEY (transaction_id) REFERENCES transactions (id)
+    )
+    ''')
+    
+    # Переносимо в чергу все, що накопичилось невідправленим
+    c.execute("""
+        INSERT OR IGNORE INTO outbox (transaction_id, account_id, created_at)
+        SELECT id, account_id, created_at FROM transactions
+        WHERE processed = 0 AND amount > 0
+    """)
+
+def migrate_client_cache(conn):
+    """Версія 3: кеш даних клієнта - хеш токена, хеш вмісту і час отримання"""
+    ensure_column(conn, 'clients', 'token_hash', 'TEXT')
+    ensure_column(conn, 'clients', 'content_hash', 'TEXT')
+    ensure_column(conn, 'clients', 'fetched_at', 'INTEGER')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_token_hash ON clients (token_hash)")
+
+def migrate_backfill_progress(conn):
+    """Версія 4: прогрес завантаження історії, щоб продовжити після переривання"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS backfill_progress (
+        account_id TEXT PRIMARY KEY,
+        from_ts INTEGER,
+        cursor_ts INTEGER,
+        fetched INTEGER DEFAULT 0,
+        started_at TEXT,
+        updated_at TEXT,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+
+def migrate_outbox_retries(conn):
+    """Версія 5: лічильник спроб, час наступної спроби і dead-letter для черги повідомлень"""
+    ensure_column(conn, 'outbox', 'attempts', 'INTEGER DEFAULT 0')
+    ensure_column(conn, 'outbox', 'next_attempt', 'INTEGER DEFAULT 0')
+    ensure_column(conn, 'outbox', 'last_error', 'TEXT')
+    ensure_column(conn, 'outbox', 'dead', 'INTEGER DEFAULT 0')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (dead, next_attempt)")
+
+def migrate_deliveries(conn):
+    """Версія 6: статус доставки кожної транзакції в кожен канал повідомлень"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS deliveries (
+        transaction_id TEXT,
+        channel TEXT,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (transaction_id, channel),
+        FOREIGN KEY (transaction_id) REFERENCES transactions (id)
+    )
+    ''')
+
+def migrate_maintenance(conn):
+    """Версія 7: час останнього обслуговування бази та індекс для вибору транзакцій до архіву"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS maintenance (
+        task TEXT PRIMARY KEY,
+        last_run INTEGER,
+        details TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_processed_time ON transactions (time) WHERE processed = 1")
+
+def migrate_claims(conn):
+    """Версія 8: оренди процесів і захоплення транзакцій в outbox перед відправкою"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        expires_at INTEGER
+    )
+    ''')
+    ensure_column(conn, 'outbox', 'claimed_by', 'TEXT')
+    ensure_column(conn, 'outbox', 'claimed_at', 'INTEGER')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_claimed_by ON outbox (claimed_by)")
+
+# Зведення: день і місяць за київським часом у розрізах усього, MCC і контрагента
+ROLLUP_OFFSET = int(KYIV_TZ.utcoffset(None).total_seconds())
+
+ROLLUP_PERIODS = [
+    f"date({{row}}time + {ROLLUP_OFFSET}, 'unixepoch')",
+    f"strftime('%Y-%m', {{row}}time + {ROLLUP_OFFSET}, 'unixepoch')",
+]
+
+ROLLUP_DIMENSIONS = [
+    ("total", "''"),
+    ("mcc", "CAST({row}mcc AS TEXT)"),
+    ("counterparty", "COALESCE(NULLIF({row}counter_name, ''), {row}description, '')"),
+]
+
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO rollups (period, account_id, dimension, key, income_count, income_amount, expense_count, expense_amount)
+    {select}
+    ON CONFLICT (period, account_id, dimension, key) DO UPDATE SET
+        income_count = income_count + excluded.income_count,
+        income_amount = income_amount + excluded.income_amount,
+        expense_count = expense_count + excluded.expense_count,
+        expense_amount = expense_amount + excluded.expense_amount
+"""
+
+def rollup_upsert_statements(row):
+    """Запити оновлення зведень: для нового рядка (row='NEW.') або для всієї таблиці (row='')"""
+    if row:
+        values = "{row}amount > 0, MAX({row}amount, 0), {row}amount < 0, MAX(-{row}amount, 0)"
+        select = "SELECT {period}, {row}account_id, '{dimension}', {key}, " + values + " WHERE true"
+    else:
+        values = "SUM(amount > 0), SUM(MAX(amount, 0)), SUM(amount < 0), SUM(MAX(-amount, 0))"
+        select = "SELECT {period}, account_id, '{dimension}', {key}, " + values + " FROM transactions WHERE true GROUP BY 1, 2, 4"
+    
+    return [
+        ROLLUP_UPSERT_SQL.format(select=select.format(period=period, dimension=dimension, key=key, row='{row}').format(row=row))
+        for period in ROLLUP_PERIODS
+        for dimension, key in ROLLUP_DIMENSIONS
+    ]
+
+def migrate_rollups(conn):
+    """Версія 9: денні та місячні зведення, що оновлюються тригером при кожному записі транзакцій"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rollups (
+        period TEXT,
+        account_id TEXT,
+        dimension TEXT,
+        key TEXT,
+        income_count INTEGER,
+        income_amount INTEGER,
+        expense_count INTEGER,
+        expense_amount INTEGER,
+        PRIMARY KEY (period, account_id, dimension, key)
+    )
+    ''')
+    
+    # Зведення за вже збереженою історією рахуються один раз
+    for sql in rollup_upsert_statements(''):
+        conn.execute(sql)
+    
+    # Тригер спрацьовує лише для справді вставлених рядків (ON CONFLICT DO NOTHING його не викликає)
+    # в тій самій транзакції БД, що й пакет транзакцій
+    body = ";\n".join(rollup_upsert_statements('NEW.'))
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_transactions_rollups AFTER INSERT ON transactions BEGIN {body}; END")
+
+def migrate_export_progress(conn):
+    """Версія 10: до якого rowid транзакції вже вивантажено в кожен каталог експорту"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS export_progress (
+        target TEXT PRIMARY KEY,
+        last_rowid INTEGER,
+        exported INTEGER DEFAULT 0,
+        updated_at TEXT
+    )
+    ''')
+
+def migrate_statement_fingerprints(conn):
+    """Версія 11: відбиток останньої відповіді виписки, щоб пропускати незмінені"""
+    ensure_column(conn, 'sync_cursors', 'fingerprint', 'TEXT')
+
+def migrate_filtered_outbox(conn):
+    """Версія 12: транзакції, прибрані з outbox фільтрами, раніше лишались необробленими"""
+    conn.execute("""
+        UPDATE transactions SET processed = 1
+        WHERE processed = 0 AND id NOT IN (SELECT transaction_id FROM outbox)
+    """)
+
+# Міграції схеми по порядку; номер версії зберігається в PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    (1, migrate_initial_schema),
+    (2, migrate_indexes_and_outbox),
+    (3, migrate_client_cache),
+    (4, migrate_backfill_progress),
+    (5, migrate_outbox_retries),
+    (6, migrate_deliveries),
+    (7, migrate_maintenance),
+    (8, migrate_claims),
+    (9, migrate_rollups),
+    (10, migrate_export_progress),
+    (11, migrate_statement_fingerprints),
+    (12, migrate_filtered_outbox),
+]
+
+def create_db(conn):
+    """Застосувати міграції схеми, яких ще немає в базі"""
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    latest_version = SCHEMA_MIGRATIONS[-1][0]
+    
+    # Звичайний запуск: схема вже актуальна, тож це одне читання PRAGMA
+    if current_version >= latest_version:
+        logger.debug("Схема бази актуальна (версія %s)", current_version)
+        return
+    
+    for version, migration in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        logger.info(f"Застосування міграції схеми до версії {version}")
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    logger.info(f"Схему бази оновлено до версії {latest_version}")
+
+class ShutdownRequested(Exception):
+    """Отримано сигнал зупинки під час очікування"""
+
+class TokenBucket:
+    """Відро токенів для обмеження частоти запитів до одного ендпоінту"""
+    
+    def __init__(self, interval, capacity=1):
+        self.interval = interval
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+    
+    def next_available(self):
+        """Скільки секунд залишилось до наступного дозволеного запиту"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return max(self.blocked_until - now, (1 - self.tokens) * self.interval, 0)
+    
+    def reserve(self):
+        """Зарезервувати запит і повернути, скільки секунд потрібно почекати перед ним"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = max(self.blocked_until - now, (1 - self.tokens) * self.interval, 0)
+            self.tokens -= 1
+            return delay
+    
+    def block(self, seconds):
+        """Заблокувати запити на вказаний час (після відповіді 429)"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens, 0)
+            self.updated = now
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+def create_rate_limits(settings):
+    """Ліміти Monobank діють окремо для кожного ендпоінту і кожного токена"""
+    return {
+        "client_info": TokenBucket(settings['client_info_delay']),
+        "statement": TokenBucket(settings['api_delay']),
+        "webhook": TokenBucket(settings['client_info_delay']),
+    }
+
+def create_api_client(session, token, settings, stop_event=None):
+    return {
+        "session": session,
+        "token": token,
+        "base_url": settings['api_base_url'],
+        "limits": create_rate_limits(settings),
+        "max_retries": settings['api_max_retries'],
+        "backoff": settings['api_backoff'],
+        "stop_event": stop_event,
+    }
+
+def wait_or_stop(seconds, stop_event=None):
+    """Почекати вказаний час; ShutdownRequested, якщо під час очікування прийшов сигнал зупинки"""
+    if seconds <= 0:
+        return
+    if stop_event is None:
+        time.sleep(seconds)
+    elif stop_event.wait(seconds):
+        raise ShutdownRequested()
+
+def get_retry_after(response, attempt, backoff):
+    """Час очікування після 429: заголовок Retry-After або експоненційна затримка"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return backoff * (2 ** attempt) + random.uniform(0, backoff)
+
+def api_request(api, endpoint, path, payload=None):
+    """Запит до Monobank API через планувальник лімітів (POST, якщо передано payload)"""
+    bucket = api['limits'][endpoint]
+    url = f"{api['base_url']}{path}"
+    headers = {'X-Token': api['token']}
+    
+    for attempt in range(api['max_retries'] + 1):
+        delay = bucket.reserve()
+        if delay > 0:
+            logger.info(f"Очікування {delay:.1f} секунд до дозволеного запиту {endpoint}")
+            wait_or_stop(delay, api['stop_event'])
+        
+        with metrics.timer('api_request_seconds', endpoint=endpoint):
+            if payload is None:
+                response = api['session'].get(url, headers=headers)
+            else:
+                response = api['session'].post(url, headers=headers, json=payload)
+        if response.status_code != 429:
+            return response
+        
+        metrics.inc('api_rate_limited_total', endpoint=endpoint)
+        if attempt < api['max_retries']:
+            metrics.inc('api_retries_total', endpoint=endpoint)
+        retry_after = get_retry_after(response, attempt, api['backoff'])
+        logger.warning(f"Перевищено ліміт запитів {endpoint} (429), повтор через {retry_after:.1f} секунд")
+        bucket.block(retry_after)
+    
+    return response
 
-def get_client_info(token, api_base_url):
+def get_client_info(api):
     logger.info("Отримання інформації про клієнта з API")
-    url = f'{api_base_url}/personal/client-info'
-    headers = {'X-Token': token}
     
-    response = requests.get(url, headers=headers)
+    response = api_request(api, 'client_info', '/personal/client-info')
     if response.status_code != 200:
         logger.error(f"Помилка API: {response.status_code}, {response.text}")
         raise Exception(f"API error: {response.status_code}, {response.text}")
@@ -164,489 +765,3121 @@ def get_client_info(token, api_base_url):
     logger.info(f"Знайдено {len(client_data.get('accounts', []))} рахунків")
     return client_data
 
-def save_client_info(client_data, db_file):
-    logger.info("Збереження даних клієнта в базу")
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-    
-    now = datetime.now(KYIV_TZ).isoformat()
+def register_webhook(api, webhook_url):
+    """Зареєструвати URL, на який Monobank надсилатиме нові транзакції"""
+    logger.info(f"Реєстрація вебхука {webhook_url}")
     
-    # Зберігаємо клієнта
-    c.execute(
-        "INSERT OR REPLACE INTO clients VALUES (?, ?, ?, ?, ?, ?)",
+    response = api_request(api, 'webhook', '/personal/webhook', {'webHookUrl': webhook_url})
+    if response.status_code != 200:
+        logger.error(f"Помилка API при реєстрації вебхука: {response.status_code}, {response.text}")
+        raise Exception(f"API error: {response.status_code}, {response.text}")
+
+# Запити, спільні для синхронного і асинхронного конвеєрів
+
+# Клієнт оновлюється, не чіпаючи його токен, отримувачів і фільтри
+SAVE_CLIENT_SQL = """
+    INSERT INTO clients (client_id, name, webhook_url, permissions, data_json, updated_at, content_hash, token_hash, fetched_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (client_id) DO UPDATE SET
+        name = excluded.name,
+        webhook_url = excluded.webhook_url,
+        permissions = excluded.permissions,
+        data_json = excluded.data_json,
+        updated_at = excluded.updated_at,
+        content_hash = excluded.content_hash,
+        token_hash = excluded.token_hash,
+        fetched_at = excluded.fetched_at
+"""
+
+CLIENT_CACHE_SQL = "SELECT client_id, data_json, content_hash, fetched_at FROM clients WHERE token_hash = ?"
+
+TOUCH_CLIENT_SQL = "UPDATE clients SET token_hash = ?, fetched_at = ? WHERE client_id = ?"
+
+EXPIRE_CLIENT_CACHE_SQL = "UPDATE clients SET fetched_at = NULL"
+
+SAVE_ACCOUNT_SQL = "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+SYNC_CURSOR_SELECT_SQL = "SELECT last_time, boundary_ids, synced_to, fingerprint FROM sync_cursors WHERE account_id = ?"
+
+SYNC_CURSOR_SAVE_SQL = """
+    INSERT OR REPLACE INTO sync_cursors (account_id, last_time, boundary_ids, synced_to, updated_at, fingerprint)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Вже збережені транзакції не перезаписуються, тож їхній processed лишається як є
+INSERT_TRANSACTION_SQL = """
+    INSERT INTO transactions (
+        id, account_id, time, description, mcc, amount, operation_amount,
+        currency_code, balance, counter_name, comment, created_at, processed
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+# Історичні транзакції одразу вважаються обробленими, листи про них не надсилаються
+INSERT_HISTORY_SQL = """
+    INSERT INTO transactions (
+        id, account_id, time, description, mcc, amount, operation_amount,
+        currency_code, balance, counter_name, comment, created_at, processed
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+BACKFILL_SELECT_SQL = "SELECT from_ts, cursor_ts, fetched FROM backfill_progress WHERE account_id = ?"
+
+BACKFILL_SAVE_SQL = "INSERT OR REPLACE INTO backfill_progress VALUES (?, ?, ?, ?, ?, ?)"
+
+ENQUEUE_OUTBOX_SQL = """
+    INSERT OR IGNORE INTO outbox (transaction_id, account_id, created_at)
+    SELECT id, account_id, created_at FROM transactions
+    WHERE processed = 0 AND id IN ({placeholders})
+"""
+
+# Лише транзакції, для яких настав час відправки (невдалі чекають свого next_attempt)
+SELECT_OUTBOX_IDS_SQL = """
+    SELECT transaction_id FROM outbox
+    WHERE transaction_id IN ({placeholders}) AND dead = 0 AND next_attempt <= CAST(strftime('%s', 'now') AS INTEGER)
+"""
+
+# Читаємо лише чергу, тож вартість залежить від кількості невідправлених, а не від історії
+PENDING_OUTBOX_SQL = """
+    SELECT t.*, t.counter_name AS counterName, o.created_at AS enqueued_at, a.iban, a.client_id
+    FROM outbox o
+    JOIN transactions t ON t.id = o.transaction_id
+    LEFT JOIN accounts a ON t.account_id = a.id
+    WHERE o.dead = 0 AND o.next_attempt <= CAST(strftime('%s', 'now') AS INTEGER)
+    ORDER BY t.time DESC
+"""
+
+OUTBOX_ATTEMPTS_SQL = "SELECT attempts FROM outbox WHERE transaction_id = ?"
+
+RETRY_OUTBOX_SQL = """
+    UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ?, dead = ?, claimed_by = NULL, claimed_at = NULL
+    WHERE transaction_id = ?
+"""
+
+# Захоплення вдається, лише якщо транзакцію ніхто не тримає або оренда попереднього власника минула
+CLAIM_OUTBOX_SQL = """
+    UPDATE outbox SET claimed_by = ?, claimed_at = ?
+    WHERE transaction_id IN ({placeholders}) AND dead = 0 AND next_attempt <= ?
+      AND (claimed_by IS NULL OR claimed_at <= ?)
+"""
+
+CLAIM_DUE_OUTBOX_SQL = """
+    UPDATE outbox SET claimed_by = ?, claimed_at = ?
+    WHERE transaction_id IN (
+        SELECT transaction_id FROM outbox
+        WHERE dead = 0 AND next_attempt <= ? AND (claimed_by IS NULL OR claimed_at <= ?)
+        ORDER BY next_attempt
+        LIMIT ?
+    )
+"""
+
+CLAIMED_IDS_SQL = "SELECT transaction_id FROM outbox WHERE claimed_by = ?"
+
+CLAIMED_OUTBOX_SQL = """
+    SELECT t.*, t.counter_name AS counterName, o.created_at AS enqueued_at, a.iban, a.client_id
+    FROM outbox o
+    JOIN transactions t ON t.id = o.transaction_id
+    LEFT JOIN accounts a ON t.account_id = a.id
+    WHERE o.claimed_by = ?
+    ORDER BY t.time DESC
+"""
+
+RELEASE_OUTBOX_SQL = "UPDATE outbox SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?"
+
+# Оренда продовжується власником або переходить до іншого, коли минула
+ACQUIRE_LEASE_SQL = """
+    INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+    WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+"""
+
+RELEASE_LEASE_SQL = "DELETE FROM leases WHERE name = ? AND owner = ?"
+
+DELIVERY_SAVE_SQL = """
+    INSERT INTO deliveries (transaction_id, channel, status, attempts, last_error, updated_at)
+    VALUES (?, ?, ?, 1, ?, ?)
+    ON CONFLICT (transaction_id, channel) DO UPDATE SET
+        status = excluded.status,
+        attempts = deliveries.attempts + 1,
+        last_error = excluded.last_error,
+        updated_at = excluded.updated_at
+"""
+
+SENT_CHANNELS_SQL = "SELECT transaction_id, channel FROM deliveries WHERE status = 'sent' AND transaction_id IN ({placeholders})"
+
+REPLAY_OUTBOX_SQL = "UPDATE outbox SET attempts = 0, next_attempt = 0, last_error = NULL, dead = 0, claimed_by = NULL, claimed_at = NULL"
+
+# Архівуються лише оброблені транзакції, яких уже немає в черзі повідомлень. Рядок з найбільшим
+# rowid лишається, щоб SQLite не видав його rowid повторно (експорт іде за зростанням rowid)
+ARCHIVE_SELECT_SQL = """
+    SELECT * FROM transactions
+    WHERE processed = 1 AND time < ?
+      AND id NOT IN (SELECT transaction_id FROM outbox)
+      AND rowid < (SELECT MAX(rowid) FROM transactions)
+    ORDER BY time
+    LIMIT ?
+"""
+
+ARCHIVE_DELETE_SQL = [
+    "DELETE FROM deliveries WHERE transaction_id IN ({placeholders})",
+    "DELETE FROM transactions WHERE id IN ({placeholders})",
+]
+
+MAINTENANCE_SELECT_SQL = "SELECT last_run, details FROM maintenance WHERE task = ?"
+
+MAINTENANCE_SAVE_SQL = "INSERT OR REPLACE INTO maintenance VALUES (?, ?, ?)"
+
+MARK_PROCESSED_SQL = "UPDATE transactions SET processed = 1 WHERE id = ?"
+
+DEQUEUE_OUTBOX_SQL = "DELETE FROM outbox WHERE transaction_id = ?"
+
+CLIENT_CONFIGS_SQL = "SELECT client_id, name, token, recipients, ignore_senders FROM clients"
+
+TENANT_TOKENS_SQL = "SELECT token FROM clients WHERE token IS NOT NULL AND token != ''"
+
+def client_row(client_data, now, content_hash=None, token_hash=None, fetched_at=None):
+    return (
+        client_data.get('clientId', ''),
+        client_data.get('name', ''),
+        client_data.get('webHookUrl', ''),
+        client_data.get('permissions', ''),
+        json.dumps(client_data),
+        now,
+        content_hash,
+        token_hash,
+        fetched_at
+    )
+
+def token_digest(token):
+    """Хеш токена для пошуку кешу (сам токен з .env у базі не зберігається)"""
+    return hashlib.sha256(token.encode()).hexdigest() if token else None
+
+def client_data_hash(client_data):
+    """Хеш вмісту відповіді client-info, щоб не переписувати незмінені дані"""
+    return hashlib.sha256(json.dumps(client_data, sort_keys=True).encode()).hexdigest()
+
+def parse_client_cache(row, now_ts, ttl):
+    """Дані клієнта з кешу, якщо вони ще свіжі, інакше None"""
+    if not row or not row['fetched_at'] or not row['data_json']:
+        return None
+    if now_ts - row['fetched_at'] >= ttl:
+        return None
+    return json.loads(row['data_json'])
+
+def account_rows(client_data, now):
+    return [
         (
+            account.get('id', ''),
             client_data.get('clientId', ''),
-            client_data.get('name', ''),
-            client_data.get('webHookUrl', ''),
-            client_data.get('permissions', ''),
-            json.dumps(client_data),
+            account.get('sendId', ''),
+            account.get('balance', 0),
+            account.get('creditLimit', 0),
+            account.get('type', ''),
+            account.get('currencyCode', 0),
+            account.get('iban', ''),
             now
         )
-    )
+        for account in client_data.get('accounts', [])
+    ]
+
+def transaction_rows(account_id, transactions, now):
+    return [
+        (
+            tx.get('id', ''),
+            account_id,
+            tx.get('time', 0),
+            tx.get('description', ''),
+            tx.get('mcc', 0),
+            tx.get('amount', 0),
+            tx.get('operationAmount', 0),
+            tx.get('currencyCode', 0),
+            tx.get('balance', 0),
+            tx.get('counterName', ''),
+            tx.get('comment', ''),
+            now
+        )
+        for tx in transactions
+    ]
+
+def id_chunks(ids, size=500):
+    """Розбити ID на частини, що вміщаються в ліміт параметрів SQLite"""
+    for offset in range(0, len(ids), size):
+        chunk = ids[offset:offset + size]
+        yield chunk, ','.join('?' * len(chunk))
+
+def get_cached_client_info(conn, token, settings):
+    """Закешовані дані клієнта для токена або None, якщо кеш застарів"""
+    if settings['client_info_ttl'] <= 0:
+        return None
+    c = conn.cursor()
+    c.execute(CLIENT_CACHE_SQL, (token_digest(token),))
+    return parse_client_cache(c.fetchone(), int(time.time()), settings['client_info_ttl'])
+
+def expire_client_cache(conn, client_id=None):
+    """Позначити кеш клієнта (або всіх клієнтів) застарілим"""
+    if client_id:
+        conn.execute(EXPIRE_CLIENT_CACHE_SQL + " WHERE client_id = ?", (client_id,))
+    else:
+        conn.execute(EXPIRE_CLIENT_CACHE_SQL)
+    conn.commit()
+
+def load_client_info(conn, api, settings):
+    """Дані клієнта з кешу, а якщо він застарів - з API зі збереженням у базу"""
+    client_data = get_cached_client_info(conn, api['token'], settings)
+    if client_data is not None:
+        logger.info(f"Дані клієнта {client_data.get('name', 'Невідомий')} взято з кешу")
+        return client_data
+    
+    client_data = get_client_info(api)
+    save_client_info(conn, client_data, api['token'])
+    return client_data
+
+def save_client_info(conn, client_data, token=None):
+    """Зберегти клієнта і рахунки; якщо вміст не змінився, оновлюється лише час отримання"""
+    c = conn.cursor()
+    
+    now = datetime.now(KYIV_TZ).isoformat()
+    content_hash = client_data_hash(client_data)
+    client_id = client_data.get('clientId', '')
+    
+    c.execute("SELECT content_hash FROM clients WHERE client_id = ?", (client_id,))
+    result = c.fetchone()
+    if result and result['content_hash'] == content_hash:
+        c.execute(TOUCH_CLIENT_SQL, (token_digest(token), int(time.time()), client_id))
+        conn.commit()
+        logger.info("Дані клієнта не змінились, перезапис пропущено")
+        return False
+    
+    logger.info("Збереження даних клієнта в базу")
     
-    # Зберігаємо рахунки
+    # Зберігаємо клієнта і рахунки
+    with metrics.timer('db_write_seconds', operation='client'):
+        c.execute(SAVE_CLIENT_SQL, client_row(client_data, now, content_hash, token_digest(token), int(time.time())))
+        c.executemany(SAVE_ACCOUNT_SQL, account_rows(client_data, now))
     for account in client_data.get('accounts', []):
-        c.execute(
-            "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                account.get('id', ''),
-                client_data.get('clientId', ''),
-                account.get('sendId', ''),
-                account.get('balance', 0),
-                account.get('creditLimit', 0),
-                account.get('type', ''),
-                account.get('currencyCode', 0),
-                account.get('iban', ''),
-                now
-            )
-        )
-        logger.info(f"Збережено рахунок {account.get('id', '')}, тип: {account.get('type', '')}")
+        logger.debug("Збережено рахунок %s, тип: %s", account.get('id', ''), account.get('type', ''))
     
     conn.commit()
-    conn.close()
     logger.info("Дані клієнта збережено в базу")
+    return True
 
-def get_statements(token, api_base_url, account_id, days=7):
-    """Отримати виписки за вказаний період"""
-    # Використовуємо київський час
-    now = datetime.now(KYIV_TZ)
-    now_ts = int(now.timestamp())
-    days_ago_ts = int((now - timedelta(days=days)).timestamp())
+# Обмеження Monobank на один запит виписки
+STATEMENT_MAX_DAYS = 31
+STATEMENT_MAX_ITEMS = 500
+
+def statement_window_start(from_ts, to_ts):
+    """Початок вікна запиту, що закінчується в to_ts і не довше 31 дня"""
+    return max(from_ts, to_ts - STATEMENT_MAX_DAYS * 86400 + 1)
+
+def statement_page_end(statements, window_from, window_to):
+    """Кінець наступного запиту: глибше в те саме вікно, якщо сторінка повна, інакше старіше вікно"""
+    if len(statements) < STATEMENT_MAX_ITEMS:
+        return window_from - 1
     
-    logger.info(f"Отримання виписки для рахунку {account_id} з {datetime.fromtimestamp(days_ago_ts, KYIV_TZ).strftime('%d.%m.%Y %H:%M')} по {datetime.fromtimestamp(now_ts, KYIV_TZ).strftime('%d.%m.%Y %H:%M')}")
+    times = [tx.get('time', 0) for tx in statements]
+    oldest = min(times)
+    
+    # Уся сторінка в одній секунді: API не гортає всередині секунди, тож решту транзакцій
+    # цієї секунди отримати неможливо, а повторний запит повернув би ту саму сторінку
+    if oldest == max(times):
+        logger.warning(
+            f"Понад {STATEMENT_MAX_ITEMS} транзакцій за одну секунду ({format_kyiv_time(oldest)}), "
+            f"частину з них API не повертає"
+        )
+        return oldest - 1
     
-    url = f'{api_base_url}/personal/statement/{account_id}/{days_ago_ts}/{now_ts}'
-    headers = {'X-Token': token}
+    # Транзакції з найстарішою секундою могли розділитися між сторінками - запитуємо її ще раз
+    # (oldest тут завжди раніше за window_to), дублікати відкидаються за ID
+    return oldest
+
+def request_statement_page(api, account_id, from_ts, to_ts):
+    """Один запит виписки (не більше 31 дня і 500 транзакцій), відповідь ще не розібрана"""
+    logger.info("Отримання виписки для рахунку %s з %s по %s", account_id, format_kyiv_time(from_ts), format_kyiv_time(to_ts))
     
-    response = requests.get(url, headers=headers)
+    response = api_request(api, 'statement', f'/personal/statement/{account_id}/{from_ts}/{to_ts}')
     if response.status_code != 200:
         logger.error(f"Помилка API при отриманні виписки: {response.status_code}, {response.text}")
         raise Exception(f"API error: {response.status_code}, {response.text}")
     
-    statements = response.json()
-    logger.info(f"Отримано {len(statements)} транзакцій для рахунку {account_id}")
-    
-    # Логуємо деталі кожної транзакції
-    for idx, tx in enumerate(statements):
-        tx_time = datetime.fromtimestamp(tx.get('time', 0), KYIV_TZ).strftime('%d.%m.%Y %H:%M')
-        amount = tx.get('amount', 0) / 100
-        description = tx.get('description', '')[:30]
-        logger.info(f"Транзакція {idx+1}/{len(statements)}: {tx_time}, {amount:.2f} грн, '{description}...'")
-    
-    return statements
+    return response
 
-def save_transaction(account_id, transaction, db_file):
-    """Зберігаємо одну транзакцію і повертаємо чи вона нова"""
-    tx_id = transaction.get('id', '')
-    amount = transaction.get('amount', 0) / 100
-    description = transaction.get('description', '')[:30]
+def get_statement_page(api, account_id, from_ts, to_ts):
+    """Один запит виписки (не більше 31 дня і 500 транзакцій)"""
+    return request_statement_page(api, account_id, from_ts, to_ts).json()
+
+def fetch_statements(api, account_id, from_ts, to_ts, fingerprint=None):
+    """Виписка за період і відбиток відповідей (хеш їхніх тіл)
     
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    Якщо відбиток збігся з fingerprint попереднього опитування, повертає (None, відбиток):
+    ті самі транзакції з тими самими балансами вже оброблено. Для вікна в один запит
+    (звичайне опитування) JSON у такому разі навіть не розбирається.
+    """
+    digest = hashlib.sha256()
+    statements = {}
+    page_to = to_ts
+    while page_to >= from_ts:
+        page_from = statement_window_start(from_ts, page_to)
+        response = request_statement_page(api, account_id, page_from, page_to)
+        digest.update(response.content)
+        if page_from == from_ts and not statements and digest.hexdigest() == fingerprint:
+            return None, fingerprint
+        
+        page = response.json()
+        for tx in page:
+            statements.setdefault(tx.get('id', ''), tx)
+        page_to = statement_page_end(page, page_from, page_to)
     
-    now = datetime.now(KYIV_TZ).isoformat()
-    is_new = False
+    if digest.hexdigest() == fingerprint:
+        return None, fingerprint
     
-    # Перевіряємо чи існує транзакція
-    c.execute("SELECT processed FROM transactions WHERE id = ?", (tx_id,))
-    result = c.fetchone()
+    statements = list(statements.values())
+    logger.info(f"Отримано {len(statements)} транзакцій для рахунку {account_id}")
     
-    if not result:
-        # Нова транзакція
-        c.execute(
-            "INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                tx_id,
-                account_id,
-                transaction.get('time', 0),
-                transaction.get('description', ''),
-                transaction.get('mcc', 0),
-                transaction.get('amount', 0),
-                transaction.get('operationAmount', 0),
-                transaction.get('currencyCode', 0),
-                transaction.get('balance', 0),
-                transaction.get('counterName', ''),
-                transaction.get('comment', ''),
-                now,
-                False  # Нова транзакція, не відправлена
+    # Деталі кожної транзакції лише на рівні DEBUG, інакше навіть не форматуємо дати
+    if logger.isEnabledFor(logging.DEBUG):
+        for idx, tx in enumerate(statements):
+            logger.debug(
+                "Транзакція %d/%d: %s, %.2f грн, '%s...'",
+                idx + 1, len(statements), format_kyiv_time(tx.get('time', 0)),
+                tx.get('amount', 0) / 100, tx.get('description', '')[:30]
             )
-        )
-        logger.info(f"Додано нову транзакцію: {tx_id}, {amount:.2f} грн, '{description}...'")
-        is_new = True
-    elif result[0] == 0:
-        # Існуюча транзакція, але ще не оброблена
-        logger.info(f"Знайдено необроблену транзакцію: {tx_id}, {amount:.2f} грн, '{description}...'")
-        is_new = True
-    else:
-        logger.info(f"Транзакція вже оброблена: {tx_id}, {amount:.2f} грн, '{description}...'")
-    
-    conn.commit()
-    conn.close()
     
-    return is_new
+    return statements, digest.hexdigest()
 
-def should_process_transaction(transaction, ignore_senders):
-    """Перевіряємо чи потрібно обробляти цю транзакцію"""
-    tx_id = transaction.get('id', '')
-    amount = transaction.get('amount', 0) / 100
+def get_sync_cursor(conn, account_id):
+    """Отримати курсор синхронізації рахунку або None, якщо рахунок ще не синхронізувався"""
+    c = conn.cursor()
+    c.execute(SYNC_CURSOR_SELECT_SQL, (account_id,))
+    return parse_sync_cursor(c.fetchone())
+
+def parse_sync_cursor(result):
+    if not result:
+        return None
     
-    # Перевіряємо що це вхідний платіж (сума > 0)
-    if transaction.get('amount', 0) <= 0:
-        logger.info(f"Пропускаємо транзакцію {tx_id} (не вхідний платіж, сума: {amount:.2f} грн)")
-        return False
+    return {
+        "last_time": result[0],
+        "boundary_ids": set(json.loads(result[1] or '[]')),
+        "synced_to": result[2],
+        "fingerprint": result[3],
+    }
+
+def get_sync_window(cursor, now_ts, settings):
+    """Початок періоду запиту виписки з урахуванням курсора"""
+    full_window_ts = now_ts - settings['days_to_fetch'] * 86400
     
-    # Перевіряємо що відправник не в списку ігнорованих
-    counter_name = transaction.get('counterName', '')
-    for ignore_sender in ignore_senders:
-        if ignore_sender.strip() in counter_name:
-            logger.info(f"Пропускаємо транзакцію {tx_id} (від '{ignore_sender.strip()}')")
-            return False
+    # Перша синхронізація або розрив довший за вікно - беремо повне вікно
+    if cursor is None or cursor['synced_to'] is None or cursor['synced_to'] < full_window_ts:
+        return full_window_ts
     
-    logger.info(f"Транзакція {tx_id} відповідає критеріям для обробки (сума: {amount:.2f} грн)")
-    return True
+    # Невелике перекриття, щоб не пропустити транзакції, що проведені із запізненням
+    return max(full_window_ts, cursor['synced_to'] - settings['sync_overlap'])
 
-def send_transaction_email(transaction, client_name, settings):
-    """Відправка повідомлення про одну транзакцію"""
-    tx_id = transaction.get('id', '')
-    amount = transaction.get('amount', 0) / 100
-    description = transaction.get('description', '')
-    short_desc = description[:30] + '...' if len(description) > 30 else description
+def skip_seen_statements(statements, cursor):
+    """Відкинути транзакції, які вже були на межі курсора"""
+    if cursor is None or not cursor['boundary_ids']:
+        return statements
     
-    logger.info(f"Підготовка до відправки повідомлення для транзакції {tx_id} ({amount:.2f} грн)")
+    return [
+        tx for tx in statements
+        if not (tx.get('time', 0) == cursor['last_time'] and tx.get('id', '') in cursor['boundary_ids'])
+    ]
+
+def update_sync_cursor(conn, account_id, cursor, statements, synced_to, fingerprint=None):
+    """Зсунути курсор рахунку після успішної обробки виписки"""
+    c = conn.cursor()
+    with metrics.timer('db_write_seconds', operation='cursor'):
+        c.execute(SYNC_CURSOR_SAVE_SQL, sync_cursor_row(account_id, cursor, statements, synced_to, fingerprint))
+        conn.commit()
+
+def sync_cursor_row(account_id, cursor, statements, synced_to, fingerprint=None):
+    """Новий стан курсора: найпізніший час і ID транзакцій на цій межі"""
+    last_time = cursor['last_time'] if cursor else None
+    boundary_ids = set(cursor['boundary_ids']) if cursor else set()
     
-    # Форматуємо дату і час з київським часовим поясом
-    tx_timestamp = transaction.get('time', 0)
-    tx_time = datetime.fromtimestamp(tx_timestamp, KYIV_TZ).strftime('%d.%m.%Y %H:%M')
-    now = datetime.now(KYIV_TZ).strftime("%d.%m.%Y %H:%M")
+    for tx in statements:
+        tx_time = tx.get('time', 0)
+        if last_time is None or tx_time > last_time:
+            last_time = tx_time
+            boundary_ids = {tx.get('id', '')}
+        elif tx_time == last_time:
+            boundary_ids.add(tx.get('id', ''))
     
-    subject = f"Новий платіж Monobank: {amount:.2f} грн - {short_desc}"
+    return (
+        account_id,
+        last_time,
+        json.dumps(sorted(boundary_ids)),
+        synced_to,
+        datetime.now(KYIV_TZ).isoformat(),
+        fingerprint
+    )
+
+def save_transactions(conn, account_id, transactions, ignored=()):
+    """Зберегти сторінку виписки однією транзакцією БД
     
-    # Створюємо красивий HTML для листа
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                font-family: 'Helvetica Neue', Arial, sans-serif;
-                color: #333;
-                line-height: 1.6;
-                margin: 0;
-                padding: 0;
-                background-color: #f9f9f9;
-            }}
-            .container {{
-                max-width: 700px;
-                margin: 20px auto;
-                background: #fff;
-                border-radius: 8px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                padding: 25px;
-            }}
-            h1 {{
-                color: #333;
-                font-size: 24px;
-                margin-top: 0;
-                border-bottom: 2px solid #f0f0f0;
-                padding-bottom: 10px;
-            }}
-            .header-info {{
-                color: #666;
-                font-size: 14px;
-                margin-bottom: 20px;
-            }}
-            .transaction {{
-                background: #f7f9fc;
-                border-left: 4px solid #22a9d1;
-                border-radius: 4px;
-                padding: 15px;
-                margin-bottom: 15px;
-                transition: all 0.3s;
-            }}
-            .amount {{
-                font-size: 24px;
-                font-weight: bold;
-                color: #28a745;
-                margin-bottom: 5px;
-            }}
-            .time {{
-                color: #6c757d;
-                font-size: 14px;
-                margin-bottom: 10px;
-            }}
-            .description {{
-                margin: 10px 0;
-                font-size: 16px;
-                font-weight: 500;
-            }}
-            .details {{
-                display: flex;
-                margin-top: 15px;
-                font-size: 14px;
-                color: #666;
-            }}
-            .detail-item {{
-                margin-right: 15px;
-            }}
-            .sender {{
-                background: #f0f0f0;
-                border-radius: 3px;
-                padding: 8px 12px;
-                margin-top: 12px;
-                font-style: italic;
-                color: #555;
-                font-size: 15px;
-            }}
-            .comment {{
-                margin-top: 12px;
-                padding: 8px 12px;
-                background: #fff8e1;
-                border-radius: 3px;
-                font-size: 14px;
-                border-left: 2px solid #ffd54f;
-            }}
-            .footer {{
-                margin-top: 30px;
-                font-size: 12px;
-                color: #999;
-                text-align: center;
-                border-top: 1px solid #eee;
-                padding-top: 15px;
-            }}
-            .logo {{
-                color: #22a9d1;
-                font-weight: bold;
-                font-size: 18px;
-                text-decoration: none;
-            }}
-            .id-field {{
-                font-family: monospace;
-                background: #f5f5f5;
-                padding: 3px 6px;
-                border-radius: 3px;
-                font-size: 13px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Новий платіж на рахунок Monobank</h1>
-            <div class="header-info">
-                <p>Клієнт: <strong>{client_name}</strong></p>
-                <p>Повідомлення створено: {now} (Київ, UTC+3)</p>
-            </div>
-            
-            <div class="transaction">
-                <div class="amount">{amount:.2f} грн</div>
-                <div class="time">Дата операції: {tx_time} (Київ, UTC+3)</div>
-                <div class="description">{description}</div>
-                
-                <div class="details">
-                    <div class="detail-item">MCC: {transaction.get('mcc', 'Невідомо')}</div>
-                    <div class="detail-item">ID: <span class="id-field">{tx_id}</span></div>
-                </div>
-                
-                {f'<div class="sender">Відправник: {transaction.get("counterName", "")}</div>' if transaction.get("counterName") else ""}
-                
-                {f'<div class="comment">Коментар: {transaction.get("comment", "")}</div>' if transaction.get("comment") else ""}
-            </div>
-            
-            <div class="footer">
-                <p>Це автоматичне повідомлення від системи моніторингу платежів Monobank.</p>
-                <p><span class="logo">Mono</span>Monitor</p>
-            </div>
-        </div>
-    </body>
-    </html>
+    ignored - транзакції, що не пройшли фільтри: зберігаються вже обробленими, щоб зведення
+    й експорт бачили всю історію, і в чергу повідомлень не потрапляють.
+    Повертає множину ID, для яких ще не відправлено повідомлення (нові та раніше необроблені).
     """
+    if not transactions and not ignored:
+        return set()
     
-    # Створюємо повідомлення
-    msg = MIMEMultipart()
-    msg['From'] = settings['smtp_sender']
-    msg['To'] = ', '.join(settings['smtp_recipients'])
-    msg['Subject'] = subject
-    
-    # Додаємо HTML
-    msg.attach(MIMEText(html, 'html'))
+    c = conn.cursor()
+    now = datetime.now(KYIV_TZ).isoformat()
     
-    try:
-        # Відправляємо лист
-        logger.info(f"Відправка повідомлення для транзакції {tx_id} через SMTP {settings['smtp_server']}:{settings['smtp_port']}")
-        server = smtplib.SMTP(settings['smtp_server'], settings['smtp_port'])
-        server.starttls()
-        server.login(settings['smtp_username'], settings['smtp_password'])
-        server.send_message(msg)
-        server.quit()
-        
-        logger.info(f"Успішно відправлено повідомлення для транзакції {tx_id}")
-        return True
+    with metrics.timer('db_write_seconds', operation='transactions'):
+        c.executemany(INSERT_HISTORY_SQL, transaction_rows(account_id, ignored, now))
+        c.executemany(INSERT_TRANSACTION_SQL, transaction_rows(account_id, transactions, now))
+        inserted = c.rowcount
         
-    except Exception as e:
-        logger.error(f"Помилка відправки листа для транзакції {tx_id}: {e}")
+        # Нові транзакції стають у чергу повідомлень, а вся черга сторінки читається одним запитом
+        pending = set()
+        for chunk, placeholders in id_chunks([tx.get('id', '') for tx in transactions]):
+            c.execute(ENQUEUE_OUTBOX_SQL.format(placeholders=placeholders), chunk)
+            c.execute(SELECT_OUTBOX_IDS_SQL.format(placeholders=placeholders), chunk)
+            pending.update(row[0] for row in c.fetchall())
+        
+        conn.commit()
+    
+    logger.info(f"Збережено {len(transactions)} транзакцій рахунку {account_id}: нових {inserted}, до відправки {len(pending)}, поза фільтрами {len(ignored)}")
+    return pending
+
+def save_transaction(conn, account_id, transaction):
+    """Зберігаємо одну транзакцію і повертаємо чи вона нова"""
+    return transaction.get('id', '') in save_transactions(conn, account_id, [transaction])
+
+_transaction_filters = {}
+
+def trie_pattern(words):
+    """Регулярний вираз у формі дерева префіксів: один прохід по рядку для будь-якої кількості шаблонів"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node):
+        # Коротший шаблон уже дає збіг, довші продовження перевіряти не треба
+        if '' in node:
+            return ''
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    
+    return build(trie) if trie else None
+
+class TransactionFilter:
+    """Скомпільовані правила пропуску: відправники, MCC і межі суми (в копійках)"""
+    
+    def __init__(self, senders=(), mcc=(), min_amount=None, max_amount=None):
+        pattern = trie_pattern(sorted({s.strip() for s in senders if s and s.strip()}))
+        self.senders = re.compile(pattern) if pattern else None
+        self.mcc = frozenset(int(m) for m in mcc)
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+    
+    def skip_reason(self, transaction):
+        """Причина пропуску транзакції або None, якщо про неї треба повідомити"""
+        amount = transaction.get('amount', 0)
+        if amount <= 0:
+            return f"не вхідний платіж, сума: {amount / 100:.2f} грн"
+        if self.min_amount is not None and amount < self.min_amount:
+            return f"сума менша за {self.min_amount / 100:.2f} грн"
+        if self.max_amount is not None and amount > self.max_amount:
+            return f"сума більша за {self.max_amount / 100:.2f} грн"
+        if self.mcc and transaction.get('mcc') in self.mcc:
+            return f"MCC {transaction.get('mcc')}"
+        if self.senders is not None:
+            match = self.senders.search(transaction.get('counterName') or '')
+            if match:
+                return f"від '{match.group(0)}'"
+        return None
+    
+    def split(self, transactions):
+        """Розділити сторінку виписки за один прохід на (для обробки, пропущені з причинами)"""
+        qualifying = []
+        skipped = []
+        for tx in transactions:
+            reason = self.skip_reason(tx)
+            if reason is None:
+                qualifying.append(tx)
+            else:
+                skipped.append((tx, reason))
+        return qualifying, skipped
+
+@lru_cache(maxsize=None)
+def load_filter_rules(path):
+    """Правила з JSON-файлу: список об'єктів з account/client і senders/mcc/min_amount/max_amount"""
+    if not path:
+        return ()
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    logger.info(f"Завантажено {len(rules)} правил фільтрації з {path}")
+    return tuple(rules)
+
+def kopecks(amount):
+    """Сума в гривнях з налаштувань у копійках (0 або порожнє - без обмеження)"""
+    return round(float(amount) * 100) if amount else None
+
+def compile_transaction_filter(settings, account_id=None):
+    """Об'єднати глобальні, клієнтські і рахункові правила в один фільтр"""
+    senders = list(settings['ignore_senders'])
+    mcc = set(settings['ignore_mcc'])
+    min_amounts = [kopecks(settings['min_amount'])]
+    max_amounts = [kopecks(settings['max_amount'])]
+    
+    for rule in load_filter_rules(settings['filter_rules_file']):
+        if 'account' in rule and rule['account'] != account_id:
+            continue
+        if 'client' in rule and rule['client'] != settings.get('client_id'):
+            continue
+        senders.extend(rule.get('senders', []))
+        mcc.update(rule.get('mcc', []))
+        min_amounts.append(kopecks(rule.get('min_amount')))
+        max_amounts.append(kopecks(rule.get('max_amount')))
+    
+    # Кілька меж суми звужують діапазон
+    min_amounts = [a for a in min_amounts if a is not None]
+    max_amounts = [a for a in max_amounts if a is not None]
+    return TransactionFilter(
+        senders,
+        mcc,
+        max(min_amounts) if min_amounts else None,
+        min(max_amounts) if max_amounts else None,
+    )
+
+def get_transaction_filter(settings, account_id=None):
+    """Скомпільований фільтр для клієнта і рахунку, кешується на весь час роботи"""
+    rules = load_filter_rules(settings['filter_rules_file'])
+    if not any(rule.get('account') == account_id for rule in rules):
+        # Без правил для цього рахунку підходить спільний фільтр клієнта
+        account_id = None
+    
+    key = (
+        settings.get('client_id'), account_id, tuple(settings['ignore_senders']),
+        tuple(settings['ignore_mcc']), settings['min_amount'], settings['max_amount'],
+        settings['filter_rules_file'],
+    )
+    transaction_filter = _transaction_filters.get(key)
+    if transaction_filter is None:
+        transaction_filter = _transaction_filters[key] = compile_transaction_filter(settings, account_id)
+    return transaction_filter
+
+def precompile_filters(settings, clients):
+    """Скомпілювати фільтри для всіх клієнтів при старті"""
+    get_transaction_filter(settings)
+    for client in clients.values():
+        get_transaction_filter(get_client_settings(settings, client))
+    logger.debug(f"Фільтри транзакцій скомпільовано: {len(_transaction_filters)}")
+
+def should_process_transaction(transaction, settings, account_id=None):
+    """Перевіряємо чи потрібно обробляти цю транзакцію"""
+    tx_id = transaction.get('id', '')
+    transaction_filter = get_transaction_filter(settings, account_id or transaction.get('account_id'))
+    
+    reason = transaction_filter.skip_reason(transaction)
+    if reason is not None:
+        logger.debug("Пропускаємо транзакцію %s (%s)", tx_id, reason)
         return False
+    
+    logger.debug("Транзакція %s відповідає критеріям для обробки (сума: %.2f грн)", tx_id, transaction.get('amount', 0) / 100)
+    return True
 
-def mark_as_processed(transaction_id, db_file):
-    """Позначити транзакцію як оброблену"""
-    conn = sqlite3.connect(db_file)
+def filter_transactions(transactions, settings, account_id):
+    """Відібрати транзакції сторінки виписки одним проходом, повертає (для обробки, пропущені)"""
+    qualifying, skipped = get_transaction_filter(settings, account_id).split(transactions)
+    if logger.isEnabledFor(logging.DEBUG):
+        for tx, reason in skipped:
+            logger.debug("Пропускаємо транзакцію %s (%s)", tx.get('id', ''), reason)
+    return qualifying, [tx for tx, _ in skipped]
+
+TEMPLATE_NAMES = ["transaction.html", "transaction.txt", "digest.html", "digest.txt"]
+
+TEMPLATE_FRAGMENTS = {"styles": "styles.css", "footer": "footer.html"}
+
+_templates = {}
+
+@lru_cache(maxsize=4096)
+def format_kyiv_time(timestamp):
+    """Час за Києвом; однакові мітки в зведеннях форматуються один раз"""
+    return datetime.fromtimestamp(timestamp or 0, KYIV_TZ).strftime('%d.%m.%Y %H:%M')
+
+def format_money(amount):
+    """Сума в копійках у вигляді гривень"""
+    return f"{(amount or 0) / 100:.2f}"
+
+def create_template_env(templates_dir, client_id=None):
+    """Середовище Jinja2, де шаблони клієнта перекривають стандартні"""
+    import jinja2
+    from markupsafe import Markup
+    
+    loaders = []
+    client_dir = Path(templates_dir) / "clients" / str(client_id)
+    if client_id and client_dir.is_dir():
+        loaders.append(jinja2.FileSystemLoader(str(client_dir)))
+    loaders.append(jinja2.FileSystemLoader(str(templates_dir)))
+    
+    env = jinja2.Environment(
+        loader=jinja2.ChoiceLoader(loaders),
+        autoescape=jinja2.select_autoescape(['html']),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False,
+        cache_size=-1,
+    )
+    env.filters['kyiv_time'] = format_kyiv_time
+    env.filters['money'] = format_money
+    
+    # Статичні фрагменти читаються один раз і вставляються як готова розмітка
+    for name, filename in TEMPLATE_FRAGMENTS.items():
+        source = env.loader.get_source(env, filename)[0]
+        env.globals[name] = Markup(source)
+    
+    return env
+
+def get_templates(settings):
+    """Скомпільовані шаблони клієнта з налаштувань, кешуються на весь час роботи"""
+    key = (settings['templates_dir'], settings.get('client_id'))
+    templates = _templates.get(key)
+    if templates is None:
+        env = create_template_env(*key)
+        templates = _templates[key] = {name: env.get_template(name) for name in TEMPLATE_NAMES}
+    return templates
+
+def precompile_templates(settings, client_ids=()):
+    """Скомпілювати стандартні шаблони і перевизначення клієнтів при старті"""
+    for client_id in (None, *client_ids):
+        get_templates(dict(settings, client_id=client_id))
+    logger.debug(f"Шаблони листів скомпільовано: {len(_templates)} наборів")
+
+def render_email(settings, name, **context):
+    """Текстова і HTML-версії листа за стандартним або клієнтським шаблоном"""
+    templates = get_templates(settings)
+    context['now'] = datetime.now(KYIV_TZ).strftime("%d.%m.%Y %H:%M")
+    text = templates[f"{name}.txt"].render(context)
+    html = templates[f"{name}.html"].render(context)
+    return text, html
+
+def render_text(settings, name, **context):
+    """Лише текстова версія повідомлення (для месенджерів і вебхуків)"""
+    context['now'] = datetime.now(KYIV_TZ).strftime("%d.%m.%Y %H:%M")
+    return get_templates(settings)[f"{name}.txt"].render(context)
+
+def build_email_message(subject, text, html, settings):
+    """Лист з текстовою альтернативою для клієнтів без підтримки HTML"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    
+    msg = MIMEMultipart('alternative')
+    msg['From'] = settings['smtp_sender']
+    msg['To'] = ', '.join(settings['smtp_recipients'])
+    msg['Subject'] = subject
+    msg.attach(MIMEText(text, 'plain', 'utf-8'))
+    msg.attach(MIMEText(html, 'html', 'utf-8'))
+    return msg
+
+def build_transaction_email(transaction, client_name, settings):
+    """Лист про одну транзакцію"""
+    tx_id = transaction.get('id', '')
+    amount = transaction.get('amount', 0) / 100
+    description = transaction.get('description', '')
+    short_desc = description[:30] + '...' if len(description) > 30 else description
+    
+    logger.debug("Підготовка до відправки повідомлення для транзакції %s (%.2f грн)", tx_id, amount)
+    
+    subject = f"Новий платіж Monobank: {amount:.2f} грн - {short_desc}"
+    text, html = render_email(settings, "transaction", tx=transaction, client_name=client_name)
+    
+    return build_email_message(subject, text, html, settings)
+
+class SmtpConnection:
+    """Автентифіковане SMTP-з'єднання, що використовується для багатьох листів"""
+    
+    def __init__(self, settings):
+        self.settings = settings
+        self.server = None
+        self.sent = 0
+    
+    def connect(self):
+        import smtplib
+        
+        settings = self.settings
+        logger.info(f"Підключення до SMTP {settings['smtp_server']}:{settings['smtp_port']}")
+        server = smtplib.SMTP(settings['smtp_server'], settings['smtp_port'], timeout=settings['smtp_timeout'])
+        try:
+            if settings['smtp_starttls']:
+                server.starttls()
+            if settings['smtp_username']:
+                server.login(settings['smtp_username'], settings['smtp_password'])
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.sent = 0
+    
+    def send(self, msg):
+        import smtplib
+        
+        # Провайдери обмежують кількість листів за одне з'єднання, тому періодично перепідключаємось
+        if self.server is not None and self.sent >= self.settings['smtp_max_messages']:
+            self.close()
+        
+        with metrics.timer('smtp_send_seconds'):
+            for attempt in range(2):
+                if self.server is None:
+                    self.connect()
+                try:
+                    self.server.send_message(msg)
+                    self.sent += 1
+                    return
+                except OSError as e:
+                    # Відмову прийняти лист (адресат, вміст) перепідключення не виправить,
+                    # а з'єднання після неї лишається робочим; 421 - сервер закриває канал
+                    if isinstance(e, smtplib.SMTPException) and not (
+                        isinstance(e, smtplib.SMTPServerDisconnected) or getattr(e, 'smtp_code', None) == 421
+                    ):
+                        raise
+                    
+                    # Сервер закрив простояне з'єднання - один раз перепідключаємось
+                    self.abort()
+                    if attempt:
+                        raise
+                    metrics.inc('smtp_reconnects_total')
+    
+    def abort(self):
+        if self.server is not None:
+            try:
+                self.server.close()
+            finally:
+                self.server = None
+    
+    def close(self):
+        import smtplib
+        
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.abort()
+
+class SmtpPool:
+    """Обмежений пул SMTP-з'єднань для паралельної відправки"""
+    
+    def __init__(self, settings, size):
+        self.settings = settings
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.size)
+    
+    def send(self, msg):
+        with self.slots:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = SmtpConnection(self.settings)
+            try:
+                connection.send(msg)
+            finally:
+                self.idle.put(connection)
+    
+    def send_many(self, messages):
+        """Відправити листи паралельно; для кожного повертає None або помилку"""
+        def send_one(msg):
+            try:
+                self.send(msg)
+                return None
+            except Exception as e:
+                return e
+        
+        if self.size == 1 or len(messages) < 2:
+            return [send_one(msg) for msg in messages]
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=min(self.size, len(messages))) as executor:
+            return list(executor.map(send_one, messages))
+    
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+# Пули за SMTP-конфігурацією, щоб з'єднання жили між листами і циклами
+_smtp_pools = {}
+_smtp_pools_lock = threading.Lock()
+
+def get_smtp_pool(settings):
+    key = (settings['smtp_server'], settings['smtp_port'], settings['smtp_username'], settings['smtp_password'])
+    with _smtp_pools_lock:
+        if key not in _smtp_pools:
+            _smtp_pools[key] = SmtpPool(settings, settings['smtp_pool_size'])
+        return _smtp_pools[key]
+
+def close_smtp_pools():
+    with _smtp_pools_lock:
+        for pool in _smtp_pools.values():
+            pool.close()
+        _smtp_pools.clear()
+
+def send_transaction_email(transaction, client_name, settings):
+    """Відправка повідомлення про одну транзакцію"""
+    return send_transaction_emails([(transaction, client_name, settings)])[0] is None
+
+def send_transaction_emails(items):
+    """Пакетна відправка повідомлень [(transaction, client_name, settings), ...]
+    
+    Листи з однаковою SMTP-конфігурацією йдуть через спільний пул з'єднань паралельно.
+    Повертає список помилок у тому ж порядку (None - лист відправлено).
+    """
+    results = ["не відправлено"] * len(items)
+    batches = {}
+    for index, (transaction, client_name, settings) in enumerate(items):
+        msg = build_transaction_email(transaction, client_name, settings)
+        batches.setdefault(get_smtp_pool(settings), []).append((index, msg))
+    
+    for pool, batch in batches.items():
+        logger.info(f"Відправка {len(batch)} повідомлень через SMTP {pool.settings['smtp_server']}:{pool.settings['smtp_port']}")
+        errors = pool.send_many([msg for _, msg in batch])
+        
+        for (index, _), error in zip(batch, errors):
+            tx_id = items[index][0].get('id', '')
+            if error is None:
+                logger.debug("Успішно відправлено повідомлення для транзакції %s", tx_id)
+                metrics.inc('emails_total', result='sent')
+                observe_delivery([items[index][0]])
+                results[index] = None
+            else:
+                metrics.inc('emails_total', result='failed')
+                logger.error(f"Помилка відправки листа для транзакції {tx_id}: {error}")
+                results[index] = str(error)
+    
+    return results
+
+class SmtpNotifier:
+    """Канал email: листи через спільні пули SMTP-з'єднань (паралельність - SMTP_POOL_SIZE)"""
+    
+    channel = 'smtp'
+    
+    def send_many(self, items):
+        return send_transaction_emails(items)
+    
+    def close(self):
+        # Пули закриває close_smtp_pools(), ними ж користуються зведення
+        pass
+
+class HttpNotifier(ABC):
+    """Канал повідомлень через HTTP POST з власним пулом з'єднань і обмеженням паралельності"""
+    
+    channel = None
+    
+    def __init__(self, concurrency, timeout):
+        import requests
+        
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Асинхронний клієнт і семафор прив'язані до циклу подій, тож створюються в ньому
+        self.client = None
+        self.semaphore = None
+    
+    @abstractmethod
+    def build_requests(self, transaction, client_name, settings):
+        """Список (url, json) для однієї транзакції"""
+    
+    def check_response(self, status_code, text):
+        if status_code >= 300:
+            raise Exception(f"HTTP {status_code}: {text[:200]}")
+    
+    def send(self, item):
+        with metrics.timer('notify_send_seconds', channel=self.channel):
+            for url, payload in self.build_requests(*item):
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                self.check_response(response.status_code, response.text)
+    
+    def send_many(self, items):
+        """Відправити паралельно (не більше concurrency запитів), для кожного повертає None або помилку"""
+        def send_one(item):
+            try:
+                self.send(item)
+                return None
+            except Exception as e:
+                logger.error(f"Помилка відправки в {self.channel} для транзакції {item[0].get('id', '')}: {e}")
+                return str(e)
+        
+        if self.concurrency == 1 or len(items) < 2:
+            return [send_one(item) for item in items]
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as executor:
+            return list(executor.map(send_one, items))
+    
+    async def send_async(self, item):
+        """Асинхронна відправка через власний httpx-клієнт каналу"""
+        import asyncio
+        import httpx
+        
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            )
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            with metrics.timer('notify_send_seconds', channel=self.channel):
+                for url, payload in self.build_requests(*item):
+                    response = await self.client.post(url, json=payload)
+                    self.check_response(response.status_code, response.text)
+    
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            self.semaphore = None
+    
+    def close(self):
+        self.session.close()
+
+class WebhookNotifier(HttpNotifier):
+    """Довільний HTTP-вебхук: JSON з транзакцією або {"text": ...} для Slack-сумісних приймачів"""
+    
+    channel = 'webhook'
+    
+    def __init__(self, url, payload_format, concurrency, timeout):
+        super().__init__(concurrency, timeout)
+        self.url = url
+        self.payload_format = payload_format
+    
+    def build_requests(self, transaction, client_name, settings):
+        if self.payload_format == 'slack':
+            return [(self.url, {"text": render_text(settings, "transaction", tx=transaction, client_name=client_name)})]
+        return [(self.url, {
+            "client_id": settings.get('client_id'),
+            "client_name": client_name,
+            "account_id": transaction.get('account_id'),
+            "transaction": transaction,
+        })]
+
+class TelegramNotifier(HttpNotifier):
+    """Telegram Bot API: текстова версія листа в кожен чат"""
+    
+    channel = 'telegram'
+    
+    def __init__(self, api_url, bot_token, chat_ids, concurrency, timeout):
+        super().__init__(concurrency, timeout)
+        self.url = f"{api_url}/bot{bot_token}/sendMessage"
+        self.chat_ids = chat_ids
+    
+    def build_requests(self, transaction, client_name, settings):
+        text = render_text(settings, "transaction", tx=transaction, client_name=client_name)
+        return [
+            (self.url, {"chat_id": chat_id, "text": text, "disable_web_page_preview": True})
+            for chat_id in self.chat_ids
+        ]
+
+# Канали за конфігурацією, щоб пули з'єднань жили між циклами
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+def create_notifier(channel, settings):
+    if channel == 'smtp':
+        return SmtpNotifier()
+    if channel == 'webhook':
+        return WebhookNotifier(
+            settings['notify_webhook_url'], settings['notify_webhook_format'],
+            settings['notify_webhook_concurrency'], settings['notify_http_timeout']
+        )
+    if channel == 'telegram':
+        return TelegramNotifier(
+            settings['telegram_api_url'], settings['telegram_bot_token'], settings['telegram_chat_ids'],
+            settings['telegram_concurrency'], settings['notify_http_timeout']
+        )
+    raise ValueError(f"Невідомий канал повідомлень: {channel}")
+
+def get_notifiers(settings):
+    """Канали повідомлень з NOTIFY_CHANNELS"""
+    notifiers = []
+    with _notifiers_lock:
+        for channel in settings['notify_channels']:
+            notifier = _notifiers.get(channel)
+            if notifier is None:
+                notifier = _notifiers[channel] = create_notifier(channel, settings)
+            notifiers.append(notifier)
+    return notifiers
+
+def close_notifiers():
+    with _notifiers_lock:
+        for notifier in _notifiers.values():
+            notifier.close()
+        _notifiers.clear()
+    close_smtp_pools()
+
+async def close_notifiers_async():
+    """Закрити асинхронні клієнти каналів до завершення циклу подій"""
+    with _notifiers_lock:
+        notifiers = [notifier for notifier in _notifiers.values() if isinstance(notifier, HttpNotifier)]
+    for notifier in notifiers:
+        await notifier.aclose()
+
+def delivery_row(transaction_id, channel, error):
+    return (transaction_id, channel, 'sent' if error is None else 'failed', error, datetime.now(KYIV_TZ).isoformat())
+
+def get_sent_channels(conn, transaction_ids):
+    """Пари (транзакція, канал), куди повідомлення вже доставлено в попередніх спробах"""
     c = conn.cursor()
+    sent = set()
+    for chunk, placeholders in id_chunks(transaction_ids):
+        c.execute(SENT_CHANNELS_SQL.format(placeholders=placeholders), chunk)
+        sent.update((row[0], row[1]) for row in c.fetchall())
+    return sent
+
+def record_deliveries(conn, channel, results):
+    """Зберегти статус доставки в канал для кожної транзакції [(transaction_id, error), ...]"""
+    with metrics.timer('db_write_seconds', operation='deliveries'):
+        conn.executemany(DELIVERY_SAVE_SQL, [delivery_row(tx_id, channel, error) for tx_id, error in results])
+        conn.commit()
+    for _, error in results:
+        metrics.inc('notifications_total', channel=channel, result='sent' if error is None else 'failed')
+
+def deliver_transactions(conn, items):
+    """Розіслати [(transaction, client_name, settings), ...] в усі канали одночасно
+    
+    Канали, куди повідомлення вже доставлено, пропускаються. Повертає список помилок
+    у тому ж порядку (None - доставлено в усі канали).
+    """
+    errors = [None] * len(items)
+    sent = get_sent_channels(conn, [tx.get('id', '') for tx, _, _ in items])
     
-    c.execute("UPDATE transactions SET processed = 1 WHERE id = ?", (transaction_id,))
+    batches = {}
+    for index, (tx, _, settings) in enumerate(items):
+        for notifier in get_notifiers(settings):
+            if (tx.get('id', ''), notifier.channel) not in sent:
+                batches.setdefault(notifier, []).append(index)
+    if not batches:
+        return errors
     
-    conn.commit()
-    conn.close()
+    from concurrent.futures import ThreadPoolExecutor, as_completed
     
-    logger.info(f"Транзакція {transaction_id} позначена як оброблена")
+    # Кожен канал відправляє у власному потоці зі своїм пулом, тож повільний канал не затримує інші
+    with ThreadPoolExecutor(max_workers=len(batches)) as fan_out:
+        futures = {
+            fan_out.submit(notifier.send_many, [items[index] for index in indexes]): (notifier, indexes)
+            for notifier, indexes in batches.items()
+        }
+        for future in as_completed(futures):
+            notifier, indexes = futures[future]
+            try:
+                results = [None if error is None else str(error) for error in future.result()]
+            except Exception as e:
+                results = [str(e)] * len(indexes)
+            
+            record_deliveries(conn, notifier.channel, [(items[index][0].get('id', ''), error) for index, error in zip(indexes, results)])
+            for index, error in zip(indexes, results):
+                if error is not None:
+                    failure = f"{notifier.channel}: {error}"
+                    errors[index] = failure if errors[index] is None else f"{errors[index]}; {failure}"
+    
+    return errors
 
-def process_unprocessed_transactions(client_name, settings):
-    """Обробляємо невідправлені транзакції з бази"""
-    logger.info("Пошук невідправлених транзакцій в базі даних")
-    conn = sqlite3.connect(settings['db_file'])
-    conn.row_factory = sqlite3.Row
+def build_digest_email(transactions, client_name, settings):
+    """Зведений лист про кілька транзакцій з підсумками по рахунках"""
+    total = sum(tx.get('amount', 0) for tx in transactions)
+    
+    logger.info(f"Підготовка зведеного повідомлення: {len(transactions)} транзакцій на {total / 100:.2f} грн")
+    
+    # Підсумки по кожному рахунку
+    accounts = {}
+    for tx in transactions:
+        account_id = tx.get('account_id', '')
+        account = accounts.setdefault(account_id, {"id": account_id, "iban": tx.get('iban') or '', "count": 0, "amount": 0})
+        account['count'] += 1
+        account['amount'] += tx.get('amount', 0)
+    
+    subject = f"Зведення платежів Monobank: {len(transactions)} на суму {total / 100:.2f} грн"
+    text, html = render_email(
+        settings, "digest",
+        transactions=sorted(transactions, key=lambda tx: tx.get('time', 0)),
+        accounts=list(accounts.values()),
+        total=total,
+        client_name=client_name,
+    )
+    
+    return build_email_message(subject, text, html, settings)
+
+def digest_due(transactions, settings):
+    """Чи час відправляти зведення: вікно часу від найстарішої транзакції або поріг кількості"""
+    if len(transactions) >= settings['digest_max_items']:
+        return True
+    
+    oldest = min(datetime.fromisoformat(tx['enqueued_at']) for tx in transactions)
+    return (datetime.now(KYIV_TZ) - oldest).total_seconds() >= settings['digest_window']
+
+def flush_digests(conn, settings):
+    """Відправити зведення по накопичених транзакціях, повертає кількість охоплених транзакцій"""
+    # Захоплюємо всю чергу, щоб інший процес не відправив те саме зведення; невідправлене повертається
+    claim_id, transactions = claim_due_outbox(conn, settings)
+    try:
+        return send_digests(conn, transactions, settings)
+    finally:
+        release_claim(conn, claim_id)
+
+def send_digests(conn, transactions, settings):
+    if not transactions:
+        return 0
+    
+    clients = get_client_configs(conn)
+    
+    # Групуємо по клієнту або по набору отримувачів
+    groups = {}
+    for tx in transactions:
+        client = clients.get(tx['client_id'], {})
+        client_settings = get_client_settings(settings, client)
+        
+        if not should_process_transaction(tx, client_settings):
+            remove_from_outbox(conn, tx['id'])
+            continue
+        
+        if settings['digest_group_by'] == 'recipients':
+            key = tuple(sorted(r.strip() for r in client_settings['smtp_recipients']))
+        else:
+            key = tx['client_id']
+        
+        group = groups.setdefault(key, {"settings": client_settings, "names": [], "transactions": []})
+        name = client.get('name') or "Клієнт Monobank"
+        if name not in group['names']:
+            group['names'].append(name)
+        group['transactions'].append(tx)
+    
+    count = 0
+    for group in groups.values():
+        if not digest_due(group['transactions'], settings):
+            continue
+        
+        msg = build_digest_email(group['transactions'], ', '.join(group['names']), group['settings'])
+        try:
+            get_smtp_pool(group['settings']).send(msg)
+        except Exception as e:
+            logger.error(f"Помилка відправки зведення ({len(group['transactions'])} транзакцій): {e}")
+            metrics.inc('emails_total', result='failed')
+            for tx in group['transactions']:
+                record_delivery_failure(conn, tx['id'], str(e), group['settings'])
+            continue
+        
+        metrics.inc('emails_total', result='sent')
+        observe_delivery(group['transactions'])
+        
+        # Усі транзакції зведення позначаються обробленими однією транзакцією БД
+        mark_many_as_processed(conn, [tx['id'] for tx in group['transactions']])
+        logger.info(f"Відправлено зведення про {len(group['transactions'])} транзакцій")
+        count += len(group['transactions'])
+    
+    return count
+
+def flush_digests_in_thread(settings):
+    """flush_digests() з власним з'єднанням для виклику з іншого потоку"""
+    conn = open_db(settings['db_file'])
+    try:
+        return flush_digests(conn, settings)
+    finally:
+        conn.close()
+
+def mark_as_processed(conn, transaction_id):
+    """Позначити транзакцію як оброблену"""
     c = conn.cursor()
     
-    c.execute("""
-        SELECT t.*, a.iban
-        FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE t.processed = 0 AND t.amount > 0
-        ORDER BY t.time DESC
-    """)
+    with metrics.timer('db_write_seconds', operation='mark_processed'):
+        c.execute(MARK_PROCESSED_SQL, (transaction_id,))
+        c.execute(DEQUEUE_OUTBOX_SQL, (transaction_id,))
+        conn.commit()
     
-    transactions = []
-    for row in c.fetchall():
-        tx = dict(row)
-        transactions.append(tx)
+    logger.debug("Транзакція %s позначена як оброблена", transaction_id)
+
+def mark_many_as_processed(conn, transaction_ids):
+    """Позначити обробленими кілька транзакцій атомарно"""
+    c = conn.cursor()
+    
+    with metrics.timer('db_write_seconds', operation='mark_processed'):
+        c.executemany(MARK_PROCESSED_SQL, [(tx_id,) for tx_id in transaction_ids])
+        c.executemany(DEQUEUE_OUTBOX_SQL, [(tx_id,) for tx_id in transaction_ids])
+        conn.commit()
+
+def retry_schedule(attempts, settings, now_ts=None):
+    """Після attempts невдалих спроб: (dead, next_attempt) з експоненційною затримкою і джитером"""
+    if attempts >= settings['retry_max_attempts']:
+        return 1, 0
+    delay = min(settings['retry_max_delay'], settings['retry_backoff'] * 2 ** (attempts - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return 0, int((now_ts or time.time()) + delay)
+
+def record_delivery_failure(conn, transaction_id, error, settings):
+    """Зарахувати невдалу спробу: відкласти наступну або перенести в dead-letter"""
+    c = conn.cursor()
+    c.execute(OUTBOX_ATTEMPTS_SQL, (transaction_id,))
+    result = c.fetchone()
+    if result is None:
+        return
+    
+    attempts = (result['attempts'] or 0) + 1
+    dead, next_attempt = retry_schedule(attempts, settings)
+    c.execute(RETRY_OUTBOX_SQL, (attempts, next_attempt, error, dead, transaction_id))
+    conn.commit()
+    log_delivery_failure(transaction_id, attempts, dead, next_attempt)
+
+def log_delivery_failure(transaction_id, attempts, dead, next_attempt):
+    if dead:
+        metrics.inc('notifications_dead_total')
+        logger.error(f"Транзакція {transaction_id}: {attempts} невдалих спроб, перенесено в dead-letter")
+    else:
+        logger.warning(f"Транзакція {transaction_id}: спроба {attempts} невдала, наступна о {format_kyiv_time(next_attempt)}")
+
+# Власник оренд і захоплень: хост і PID процесу
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+OUTBOX_CLAIM_BATCH = 100
+
+def new_claim_id():
+    """Унікальний ID захоплення: потоки одного процесу не захоплюють ті самі транзакції"""
+    return f"{INSTANCE_ID}/{os.urandom(6).hex()}"
+
+def claim_outbox(conn, transaction_ids, settings):
+    """Захопити транзакції з outbox перед відправкою, повертає ID захоплення і множину захоплених"""
+    claim_id = new_claim_id()
+    now_ts = int(time.time())
+    for chunk, placeholders in id_chunks(transaction_ids):
+        conn.execute(
+            CLAIM_OUTBOX_SQL.format(placeholders=placeholders),
+            (claim_id, now_ts, *chunk, now_ts, now_ts - settings['claim_lease'])
+        )
+    conn.commit()
+    return claim_id, {row[0] for row in conn.execute(CLAIMED_IDS_SQL, (claim_id,))}
+
+def claim_due_outbox(conn, settings, limit=-1):
+    """Захопити до limit транзакцій, час відправки яких настав, повертає ID захоплення і рядки"""
+    claim_id = new_claim_id()
+    now_ts = int(time.time())
+    conn.execute(CLAIM_DUE_OUTBOX_SQL, (claim_id, now_ts, now_ts, now_ts - settings['claim_lease'], limit))
+    conn.commit()
+    return claim_id, [dict(row) for row in conn.execute(CLAIMED_OUTBOX_SQL, (claim_id,))]
+
+def release_claim(conn, claim_id):
+    """Повернути в чергу все, що лишилось захопленим (невідправлене і не перенесене на повтор)"""
+    conn.execute(RELEASE_OUTBOX_SQL, (claim_id,))
+    conn.commit()
+
+def acquire_lease(conn, name, ttl):
+    """Взяти або продовжити оренду для цього процесу; False, якщо вона в іншого процесу"""
+    now_ts = int(time.time())
+    c = conn.execute(ACQUIRE_LEASE_SQL, (name, INSTANCE_ID, now_ts + ttl, now_ts))
+    conn.commit()
+    return c.rowcount > 0
+
+def release_lease(conn, name):
+    conn.execute(RELEASE_LEASE_SQL, (name, INSTANCE_ID))
+    conn.commit()
+
+def remove_from_outbox(conn, transaction_id):
+    """Прибрати з черги транзакцію, про яку повідомляти не потрібно
     
-    conn.close()
+    Вона позначається обробленою, як і транзакції, що не пройшли фільтри при збереженні,
+    інакше архівація ніколи б її не забрала.
+    """
+    conn.execute(MARK_PROCESSED_SQL, (transaction_id,))
+    conn.execute(DEQUEUE_OUTBOX_SQL, (transaction_id,))
+    conn.commit()
+
+def process_unprocessed_transactions(conn, settings):
+    """Обробляємо невідправлені транзакції з бази"""
+    if settings['notify_mode'] == 'digest':
+        count = flush_digests(conn, settings)
+        logger.info(f"Зведеннями оброблено {count} транзакцій")
+        return
     
-    logger.info(f"Знайдено {len(transactions)} невідправлених транзакцій")
+    logger.info("Пошук невідправлених транзакцій в базі даних")
+    clients = get_client_configs(conn)
     
+    # Беклог захоплюється пакетами, тож кілька процесів розбирають outbox паралельно без дублів
     count = 0
-    for tx in transactions:
-        if should_process_transaction(tx, settings['ignore_senders']):
-            if send_transaction_email(tx, client_name, settings):
-                mark_as_processed(tx['id'], settings['db_file'])
-                count += 1
+    found = 0
+    attempted = set()
+    while True:
+        claim_id, transactions = claim_due_outbox(conn, settings, OUTBOX_CLAIM_BATCH)
+        
+        # Транзакція з нульовою затримкою повтору знову стає доступною - у цьому проході її не повторюємо
+        transactions = [tx for tx in transactions if tx['id'] not in attempted]
+        if not transactions:
+            release_claim(conn, claim_id)
+            break
+        found += len(transactions)
+        attempted.update(tx['id'] for tx in transactions)
+        
+        items = []
+        for tx in transactions:
+            client = clients.get(tx['client_id'], {})
+            client_settings = get_client_settings(settings, client)
+            client_name = client.get('name') or "Клієнт Monobank"
+            
+            if not should_process_transaction(tx, client_settings):
+                remove_from_outbox(conn, tx['id'])
+                continue
+            
+            items.append((tx, client_name, client_settings))
+        
+        # Пакет розсилається у всі канали одночасно
+        try:
+            for (tx, _, client_settings), error in zip(items, deliver_transactions(conn, items)):
+                if error is None:
+                    mark_as_processed(conn, tx['id'])
+                    count += 1
+                else:
+                    record_delivery_failure(conn, tx['id'], error, client_settings)
+        finally:
+            release_claim(conn, claim_id)
     
+    logger.info(f"Знайдено {found} невідправлених транзакцій")
     if count > 0:
         logger.info(f"Оброблено {count} раніше невідправлених транзакцій")
     else:
         logger.info("Невідправлених транзакцій не знайдено або всі були пропущені")
 
-def get_client_name(db_file):
+def get_client_name(conn, client_id):
     """Отримати ім'я клієнта з бази даних"""
-    conn = sqlite3.connect(db_file)
     c = conn.cursor()
     
-    c.execute("SELECT name FROM clients LIMIT 1")
+    c.execute("SELECT name FROM clients WHERE client_id = ?", (client_id,))
     result = c.fetchone()
     
-    conn.close()
-    
-    name = result[0] if result else "Клієнт Monobank"
+    name = result[0] if result and result[0] else "Клієнт Monobank"
     logger.info(f"Отримано ім'я клієнта: {name}")
     return name
 
-def main():
-    global logger
+def get_client_configs(conn):
+    """Налаштування всіх клієнтів з бази: ім'я, токен, отримувачі та фільтри"""
+    c = conn.cursor()
+    c.execute(CLIENT_CONFIGS_SQL)
+    return {row['client_id']: dict(row) for row in c.fetchall()}
+
+def get_client_settings(settings, client):
+    """Глобальні налаштування з перевизначеними для клієнта отримувачами і фільтрами"""
+    client_settings = dict(settings)
+    client_settings['client_id'] = client.get('client_id')
+    if client.get('recipients'):
+        client_settings['smtp_recipients'] = client['recipients'].split(',')
+    if client.get('ignore_senders') is not None:
+        client_settings['ignore_senders'] = [s.strip() for s in client['ignore_senders'].split(',') if s.strip()]
+    return client_settings
+
+def set_client_config(conn, client_id, token=None, recipients=None, ignore_senders=None):
+    """Зберегти токен, отримувачів або фільтри клієнта (None - не змінювати)"""
+    conn.execute(
+        """
+        INSERT INTO clients (client_id, token, recipients, ignore_senders, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (client_id) DO UPDATE SET
+            token = COALESCE(excluded.token, clients.token),
+            recipients = COALESCE(excluded.recipients, clients.recipients),
+            ignore_senders = COALESCE(excluded.ignore_senders, clients.ignore_senders)
+        """,
+        (client_id, token, recipients, ignore_senders, datetime.now(KYIV_TZ).isoformat())
+    )
+    conn.commit()
+    logger.info(f"Налаштування клієнта {client_id} збережено")
+
+def merge_tenant_tokens(settings, tenant_tokens):
+    """Токени з .env (MONO_API_TOKENS або MONO_API_TOKEN) і з таблиці clients без повторів
     
-    # Налаштування логування
-    logger = setup_logging()
+    Вбудований токен за замовчуванням використовується, лише коли MONO_API_TOKEN не задано
+    і клієнтів у базі немає.
+    """
+    tokens = list(settings['tokens'])
+    if not tokens and (settings['token_configured'] or not tenant_tokens):
+        tokens.append(settings['token'])
+    return list(dict.fromkeys(tokens + list(tenant_tokens)))
+
+def load_tenant_tokens(conn, settings):
+    c = conn.cursor()
+    c.execute(TENANT_TOKENS_SQL)
+    return merge_tenant_tokens(settings, [row['token'] for row in c.fetchall()])
+
+def create_runtime(settings):
+    """Стан процесу, що живе між циклами: база, HTTP-сесія, ліміти кожного токена"""
+    import requests
     
-    # Отримання налаштувань з .env файлу
-    settings = get_settings()
+    return {
+        "settings": settings,
+        "conn": open_db(settings['db_file']),
+        "session": requests.Session(),
+        "stop_event": threading.Event(),
+        "apis": {},
+    }
+
+def get_api_client(runtime, token):
+    """Клієнт API для токена; ліміти запитів у кожного токена свої"""
+    if token not in runtime['apis']:
+        runtime['apis'][token] = create_api_client(
+            runtime['session'], token, runtime['settings'], runtime['stop_event']
+        )
+    return runtime['apis'][token]
+
+def handle_statement_item(conn, account_id, tx, client_name, settings):
+    """Фільтр, збереження і повідомлення для однієї транзакції (з виписки або вебхука)
+    
+    Повертає 'processed', 'skipped' або 'failed'.
+    """
+    tx_id = tx.get('id', '')
+    
+    # Транзакція поза фільтрами зберігається вже обробленою - лише для зведень і експорту
+    if not should_process_transaction(tx, settings, account_id):
+        logger.debug("Транзакція %s не відповідає критеріям, пропускаємо", tx_id)
+        save_transactions(conn, account_id, [], [tx])
+        return 'skipped'
+    
+    # Зберігаємо транзакцію і перевіряємо чи вона нова
+    if not save_transaction(conn, account_id, tx):
+        logger.debug("Транзакція %s вже оброблена, пропускаємо", tx_id)
+        return 'skipped'
+    
+    return notify_transaction(conn, account_id, tx, client_name, settings)
+
+def notify_transaction(conn, account_id, tx, client_name, settings):
+    """Відправити повідомлення про збережену транзакцію і позначити її обробленою"""
+    return 'processed' if notify_transactions(conn, account_id, [tx], client_name, settings) else 'failed'
+
+def notify_transactions(conn, account_id, transactions, client_name, settings):
+    """Відправити повідомлення про збережені транзакції рахунку, повертає кількість відправлених"""
+    # У режимі зведень транзакції чекають в outbox на flush_digests()
+    if settings['notify_mode'] == 'digest':
+        return 0
+    
+    for tx in transactions:
+        # Додаємо account_id для сумісності
+        tx['account_id'] = account_id
     
-    # Створюємо базу даних, якщо вона ще не існує
-    create_db(settings['db_file'])
+    # Відправляємо лише те, що вдалося захопити: решту вже відправляє інший процес або потік
+    claim_id, claimed = claim_outbox(conn, [tx.get('id', '') for tx in transactions], settings)
+    for tx in transactions:
+        if tx.get('id', '') not in claimed:
+            logger.debug("Транзакцію %s вже відправляє інший обробник", tx.get('id', ''))
+    transactions = [tx for tx in transactions if tx.get('id', '') in claimed]
     
+    count = 0
     try:
-        logger.info(f"============= ПОЧАТОК РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============")
-        logger.info(f"Період для отримання транзакцій: {settings['days_to_fetch']} днів")
-        
-        # Отримуємо інформацію про клієнта
-        client_data = get_client_info(settings['token'], settings['api_base_url'])
-        
-        # Зберігаємо дані клієнта
-        save_client_info(client_data, settings['db_file'])
-        client_name = client_data.get('name', 'Клієнт Monobank')
-        
-        # Обробляємо невідправлені транзакції з попередніх запусків
-        process_unprocessed_transactions(client_name, settings)
-        
-        # Контроль загальної кількості транзакцій
-        total_transactions = 0
-        processed_transactions = 0
-        skipped_transactions = 0
-        
-        # Для кожного рахунку отримуємо виписки
-        for i, account in enumerate(client_data.get('accounts', [])):
-            account_id = account.get('id')
-            if account_id:
-                # Додаємо паузу перед кожним запитом окрім першого
-                if i > 0:
-                    logger.info(f"Пауза {settings['api_delay']} секунд для уникнення обмежень API...")
-                    time.sleep(settings['api_delay'])
-                
-                logger.info(f"Отримання виписки для рахунку {account_id} (тип: {account.get('type', '')})")
-                statements = get_statements(
-                    settings['token'], 
-                    settings['api_base_url'], 
-                    account_id, 
-                    days=settings['days_to_fetch']
-                )
-                
-                total_account_transactions = len(statements)
-                processed_account_transactions = 0
-                skipped_account_transactions = 0
-                
-                logger.info(f"Почато обробку {total_account_transactions} транзакцій для рахунку {account_id}")
-                
-                # Обробляємо кожну транзакцію окремо відразу
-                for tx_idx, tx in enumerate(statements):
-                    tx_id = tx.get('id', '')
-                    logger.info(f"Обробка транзакції {tx_idx+1}/{total_account_transactions}: {tx_id}")
-                    
-                    # Перевіряємо чи потрібно обробляти цю транзакцію
-                    if should_process_transaction(tx, settings['ignore_senders']):
-                        # Зберігаємо транзакцію і перевіряємо чи вона нова
-                        is_new = save_transaction(account_id, tx, settings['db_file'])
-                        
-                        if is_new:
-                            # Додаємо account_id для сумісності
-                            tx['account_id'] = account_id
-                            
-                            # Відправляємо електронний лист
-                            if send_transaction_email(tx, client_name, settings):
-                                # Позначаємо як оброблену
-                                mark_as_processed(tx['id'], settings['db_file'])
-                                processed_account_transactions += 1
-                            else:
-                                logger.warning(f"Не вдалося відправити повідомлення для транзакції {tx_id}")
-                        else:
-                            logger.info(f"Транзакція {tx_id} вже оброблена, пропускаємо")
-                            skipped_account_transactions += 1
-                    else:
-                        logger.info(f"Транзакція {tx_id} не відповідає критеріям, пропускаємо")
-                        skipped_account_transactions += 1
-                
-                logger.info(f"Завершено обробку транзакцій для рахунку {account_id}:")
-                logger.info(f"  - Оброблено: {processed_account_transactions}")
-                logger.info(f"  - Пропущено: {skipped_account_transactions}")
-                logger.info(f"  - Усього: {total_account_transactions}")
-                
-                total_transactions += total_account_transactions
-                processed_transactions += processed_account_transactions
-                skipped_transactions += skipped_account_transactions
-        
-        logger.info("============= ПІДСУМОК =============")
-        logger.info(f"Загальна кількість транзакцій: {total_transactions}")
-        logger.info(f"Оброблено нових транзакцій: {processed_transactions}")
-        logger.info(f"Пропущено транзакцій: {skipped_transactions}")
-        logger.info(f"============= КІНЕЦЬ РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============")
+        results = deliver_transactions(conn, [(tx, client_name, settings) for tx in transactions])
+        for tx, error in zip(transactions, results):
+            if error is None:
+                # Позначаємо як оброблену
+                mark_as_processed(conn, tx.get('id', ''))
+                count += 1
+            else:
+                logger.warning(f"Не вдалося відправити повідомлення для транзакції {tx.get('id', '')}")
+                record_delivery_failure(conn, tx.get('id', ''), error, settings)
+    finally:
+        release_claim(conn, claim_id)
+    
+    return count
+
+def sync_account(conn, api, account, client_name, settings):
+    """Отримати і обробити виписку одного рахунку, повертає (усього, оброблено, пропущено)"""
+    account_id = account.get('id')
+    logger.info(f"Отримання виписки для рахунку {account_id} (тип: {account.get('type', '')})")
+    
+    # Запитуємо лише транзакції після курсора синхронізації
+    now_ts = int(time.time())
+    cursor = get_sync_cursor(conn, account_id)
+    statements, fingerprint = fetch_statements(
+        api,
+        account_id,
+        get_sync_window(cursor, now_ts, settings),
+        now_ts,
+        cursor['fingerprint'] if cursor else None
+    )
+    
+    # Та сама відповідь, що й минулого разу: усе з неї вже збережено, лишається зсунути вікно
+    if statements is None:
+        update_sync_cursor(conn, account_id, cursor, [], now_ts, fingerprint)
+        metrics.inc('statements_unchanged_total')
+        logger.info(f"Виписка рахунку {account_id} не змінилась з попереднього опитування")
+        return 0, 0, 0
+    
+    statements = skip_seen_statements(statements, cursor)
+    
+    total_account_transactions = len(statements)
+    processed_account_transactions = 0
+    skipped_account_transactions = 0
+    
+    logger.info(f"Почато обробку {total_account_transactions} транзакцій для рахунку {account_id}")
+    
+    # Відбираємо транзакції, що відповідають критеріям, одним проходом по сторінці
+    qualifying, ignored = filter_transactions(statements, settings, account_id)
+    skipped_account_transactions = len(ignored)
+    
+    # Зберігаємо всю сторінку одним записом і відправляємо лише необроблені
+    pending_ids = save_transactions(conn, account_id, qualifying, ignored)
+    pending = []
+    for tx in qualifying:
+        if tx.get('id', '') in pending_ids:
+            pending.append(tx)
+        else:
+            logger.debug("Транзакція %s вже оброблена, пропускаємо", tx.get('id', ''))
+            skipped_account_transactions += 1
+    
+    if pending:
+        processed_account_transactions += notify_transactions(conn, account_id, pending, client_name, settings)
+    
+    update_sync_cursor(conn, account_id, cursor, statements, now_ts, fingerprint)
+    
+    metrics.inc('transactions_total', total_account_transactions, result='fetched')
+    metrics.inc('transactions_total', processed_account_transactions, result='processed')
+    metrics.inc('transactions_total', skipped_account_transactions, result='skipped')
+    
+    logger.info(f"Завершено обробку транзакцій для рахунку {account_id}:")
+    logger.info(f"  - Оброблено: {processed_account_transactions}")
+    logger.info(f"  - Пропущено: {skipped_account_transactions}")
+    logger.info(f"  - Усього: {total_account_transactions}")
+    
+    return total_account_transactions, processed_account_transactions, skipped_account_transactions
+
+def next_statement_job(jobs):
+    """Клієнт, чий ліміт на виписку звільниться найраніше (при рівності - за чергою)"""
+    ready = [job for job in jobs if job['accounts']]
+    if not ready:
+        return None
+    return min(ready, key=lambda job: job['api']['limits']['statement'].next_available())
+
+def run_cycle(runtime):
+    """Один цикл синхронізації всіх клієнтів: дані клієнтів, невідправлені транзакції, виписки"""
+    conn = runtime['conn']
+    settings = runtime['settings']
+    cycle_started = time.perf_counter()
+    
+    # cron може запустити наступний процес, поки попередній ще працює
+    if not acquire_lease(conn, 'sync', settings['sync_lease_ttl']):
+        logger.info("Синхронізацію зараз виконує інший процес, цикл пропущено", extra=SUMMARY)
+        return
+    
+    try:
+        logger.info(f"============= ПОЧАТОК РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============")
+        logger.info(f"Період для отримання транзакцій: {settings['days_to_fetch']} днів")
+        
+        # Отримуємо інформацію про кожного клієнта (ліміт client-info окремий для кожного токена)
+        jobs = []
+        for token in load_tenant_tokens(conn, settings):
+            api = get_api_client(runtime, token)
+            try:
+                # Запит client-info лише коли кеш застарів (дані зберігаються в базу)
+                client_data = load_client_info(conn, api, settings)
+            except ShutdownRequested:
+                raise
+            except Exception as e:
+                logger.error(f"Не вдалося отримати дані клієнта: {e}")
+                continue
+            
+            # Реєструємо вебхук, якщо він налаштований і ще не збігається
+            if settings['webhook_url'] and client_data.get('webHookUrl') != settings['webhook_url']:
+                try:
+                    register_webhook(api, settings['webhook_url'])
+                    # Закешована адреса вебхука тепер неактуальна
+                    expire_client_cache(conn, client_data.get('clientId'))
+                except ShutdownRequested:
+                    raise
+                except Exception as e:
+                    logger.error(f"Не вдалося зареєструвати вебхук: {e}")
+            jobs.append({
+                "api": api,
+                "client_id": client_data.get('clientId', ''),
+                "client_name": client_data.get('name', 'Клієнт Monobank'),
+                "accounts": [a for a in client_data.get('accounts', []) if a.get('id')],
+            })
+        
+        logger.info(f"Клієнтів у циклі: {len(jobs)}")
+        
+        # Обробляємо невідправлені транзакції з попередніх запусків
+        process_unprocessed_transactions(conn, settings)
+        
+        clients = get_client_configs(conn)
+        
+        # Контроль загальної кількості транзакцій
+        total_transactions = 0
+        processed_transactions = 0
+        skipped_transactions = 0
+        
+        # Запити виписок чергуються між клієнтами: поки один токен чекає свого ліміту,
+        # виписку отримує інший, тож пропускна здатність росте з кількістю клієнтів
+        while True:
+            job = next_statement_job(jobs)
+            if job is None:
+                break
+            
+            # Продовжуємо оренду перед кожним рахунком, бо запити виписок чекають на ліміт
+            if not acquire_lease(conn, 'sync', settings['sync_lease_ttl']):
+                logger.warning("Оренду синхронізації перехопив інший процес, цикл перервано")
+                break
+            
+            account = job['accounts'].pop(0)
+            client_settings = get_client_settings(settings, clients.get(job['client_id'], {}))
+            try:
+                total, processed, skipped = sync_account(
+                    conn, job['api'], account, job['client_name'], client_settings
+                )
+            except ShutdownRequested:
+                raise
+            except Exception as e:
+                logger.error(f"Помилка обробки рахунку {account.get('id')}: {e}", exc_info=True)
+                continue
+            
+            total_transactions += total
+            processed_transactions += processed
+            skipped_transactions += skipped
+        
+        # У режимі зведень нові транзакції цього циклу теж можуть досягти порогу
+        if settings['notify_mode'] == 'digest':
+            processed_transactions += flush_digests(conn, settings)
+        
+        logger.info("============= ПІДСУМОК =============", extra=SUMMARY)
+        logger.info(f"Загальна кількість транзакцій: {total_transactions}", extra=SUMMARY)
+        logger.info(f"Оброблено нових транзакцій: {processed_transactions}", extra=SUMMARY)
+        logger.info(f"Пропущено транзакцій: {skipped_transactions}", extra=SUMMARY)
+        logger.info(f"============= КІНЕЦЬ РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============", extra=SUMMARY)
                     
+    except ShutdownRequested:
+        logger.info("Отримано сигнал зупинки, перериваємо цикл")
     except Exception as e:
         logger.error(f"Критична помилка: {e}", exc_info=True)
+    
+    metrics.observe('cycle_seconds', time.perf_counter() - cycle_started)
+    try:
+        run_maintenance_if_due(conn, settings)
+    finally:
+        release_lease(conn, 'sync')
+    record_cycle_metrics(conn, settings)
+
+def record_cycle_metrics(conn, settings):
+    """Розмір outbox і час циклу; у режимі cron метрики записуються у файл"""
+    try:
+        metrics.set('outbox_pending', conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0").fetchone()[0])
+        metrics.set('outbox_dead', conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1").fetchone()[0])
+        metrics.set('last_cycle_timestamp_seconds', int(time.time()))
+        metrics.set('db_size_bytes', db_size(conn)[0])
+        if settings['metrics_file']:
+            write_metrics_file(settings['metrics_file'])
+    except Exception as e:
+        logger.error(f"Не вдалося оновити метрики: {e}")
+
+def run_scheduler(runtime, interval):
+    """Запускати цикли з вказаним інтервалом, доки не встановлено stop_event"""
+    stop_event = runtime['stop_event']
+    
+    while not stop_event.is_set():
+        started = time.monotonic()
+        
+        # Цикли виконуються послідовно, тому два цикли одночасно не запускаються
+        run_cycle(runtime)
+        
+        # Якщо цикл тривав довше за інтервал, наступний стартує одразу
+        elapsed = time.monotonic() - started
+        stop_event.wait(max(0, interval - elapsed))
+
+def run_daemon(runtime):
+    """Постійний режим: цикли з інтервалом poll_interval до отримання SIGTERM"""
+    settings = runtime['settings']
+    stop_event = runtime['stop_event']
+    
+    def handle_stop(signum, frame):
+        logger.info(f"Отримано сигнал {signal.Signals(signum).name}, завершуємо після поточного циклу")
+        stop_event.set()
+    
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    
+    if settings['metrics_port']:
+        start_metrics_server(settings['metrics_host'], settings['metrics_port'])
+    
+    logger.info(f"Запуск у режимі демона, інтервал опитування {settings['poll_interval']} секунд")
+    run_scheduler(runtime, settings['poll_interval'])
+    logger.info("Демон зупинено")
+
+def get_backfill_progress(conn, account_id, from_ts, to_ts, restart=False):
+    """Прогрес завантаження історії рахунку: збережений або новий від to_ts назад до from_ts"""
+    c = conn.cursor()
+    c.execute(BACKFILL_SELECT_SQL, (account_id,))
+    result = c.fetchone()
+    if result and not restart:
+        return {"from_ts": result['from_ts'], "cursor_ts": result['cursor_ts'], "fetched": result['fetched'], "started_at": None}
+    return {"from_ts": from_ts, "cursor_ts": to_ts, "fetched": 0, "started_at": datetime.now(KYIV_TZ).isoformat()}
+
+def save_backfill_page(conn, account_id, progress, statements):
+    """Записати сторінку історії разом з прогресом, щоб після переривання не було пропусків"""
+    now = datetime.now(KYIV_TZ).isoformat()
+    with metrics.timer('db_write_seconds', operation='backfill'):
+        conn.executemany(INSERT_HISTORY_SQL, transaction_rows(account_id, statements, now))
+        conn.execute(BACKFILL_SAVE_SQL, (
+            account_id, progress['from_ts'], progress['cursor_ts'], progress['fetched'],
+            progress['started_at'] or now, now
+        ))
+        conn.commit()
+
+def backfill_account_page(conn, api, account_id, progress):
+    """Завантажити одну сторінку історії рахунку, повертає True, якщо історію завантажено повністю"""
+    page_to = progress['cursor_ts']
+    page_from = statement_window_start(progress['from_ts'], page_to)
+    statements = get_statement_page(api, account_id, page_from, page_to)
+    
+    progress['cursor_ts'] = statement_page_end(statements, page_from, page_to)
+    progress['fetched'] += len(statements)
+    save_backfill_page(conn, account_id, progress, statements)
+    
+    done = progress['cursor_ts'] < progress['from_ts']
+    logger.info(
+        f"Історія рахунку {account_id}: отримано {progress['fetched']} транзакцій, "
+        f"{'завершено' if done else 'продовжуємо з ' + format_kyiv_time(progress['cursor_ts'])}"
+    )
+    return done
+
+def run_backfill(runtime, days, restart=False):
+    """Завантажити історію всіх рахунків за days днів сторінками в межах лімітів API"""
+    conn = runtime['conn']
+    settings = runtime['settings']
+    stop_event = runtime['stop_event']
+    
+    def handle_stop(signum, frame):
+        logger.info(f"Отримано сигнал {signal.Signals(signum).name}, зберігаємо прогрес і зупиняємось")
+        stop_event.set()
+    
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    
+    # Старіші транзакції вже в архіві: повторний імпорт задвоїв би їх у зведеннях
+    if 0 < settings['retention_days'] < days:
+        logger.warning(f"Глибину історії обмежено RETENTION_DAYS: {settings['retention_days']} днів")
+        days = settings['retention_days']
+    
+    now_ts = int(time.time())
+    from_ts = now_ts - days * 86400
+    
+    jobs = []
+    for token in load_tenant_tokens(conn, settings):
+        api = get_api_client(runtime, token)
+        try:
+            client_data = load_client_info(conn, api, settings)
+        except ShutdownRequested:
+            return
+        except Exception as e:
+            logger.error(f"Не вдалося отримати дані клієнта: {e}")
+            continue
+        
+        accounts = []
+        for account in client_data.get('accounts', []):
+            if not account.get('id'):
+                continue
+            # Історія зберігається вже обробленою, тож усе, що ще отримає опитування, лишаємо йому:
+            # інакше платіж, який надійшов після останнього опитування, лишився б без повідомлення
+            to_ts = get_sync_window(get_sync_cursor(conn, account['id']), now_ts, settings)
+            progress = get_backfill_progress(conn, account['id'], from_ts, to_ts, restart)
+            if progress['cursor_ts'] >= progress['from_ts']:
+                accounts.append({"id": account['id'], "progress": progress})
+        jobs.append({"api": api, "accounts": accounts})
+    
+    logger.info(f"Завантаження історії: {sum(len(job['accounts']) for job in jobs)} рахунків")
+    
+    # Запити чергуються між клієнтами, а рахунки одного клієнта - по колу
+    try:
+        while True:
+            job = next_statement_job(jobs)
+            if job is None:
+                break
+            
+            account = job['accounts'].pop(0)
+            try:
+                done = backfill_account_page(conn, job['api'], account['id'], account['progress'])
+            except ShutdownRequested:
+                raise
+            except Exception as e:
+                logger.error(f"Помилка завантаження історії рахунку {account['id']}: {e}")
+                continue
+            
+            if not done:
+                job['accounts'].append(account)
+    except ShutdownRequested:
+        logger.info("Завантаження історії перервано, повторний запуск продовжить з місця зупинки")
+        return
+    
+    logger.info("Завантаження історії завершено")
+
+def print_backfill_status(conn):
+    """Показати прогрес завантаження історії по рахунках"""
+    c = conn.cursor()
+    c.execute("SELECT account_id, from_ts, cursor_ts, fetched, updated_at FROM backfill_progress")
+    for row in c.fetchall():
+        done = row['cursor_ts'] < row['from_ts']
+        print(
+            f"{row['account_id']}\tз {format_kyiv_time(row['from_ts'])}\t"
+            f"{'завершено' if done else 'до ' + format_kyiv_time(row['cursor_ts'])}\t"
+            f"транзакцій: {row['fetched']}\tоновлено: {row['updated_at']}"
+        )
+
+ARCHIVE_BATCH_SIZE = 5000
+
+def archive_path(archive_dir, month):
+    return Path(archive_dir) / f"transactions-{month}.jsonl.gz"
+
+def write_archive(path, rows):
+    """Дописати рядки в архів окремим gzip-членом і скинути його на диск"""
+    import gzip
+    
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+            for row in rows:
+                f.write((json.dumps(row, ensure_ascii=False) + "\n").encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def archive_transactions(conn, settings, now_ts=None):
+    """Перенести оброблені транзакції, старші за RETENTION_DAYS, у стиснуті місячні архіви
+    
+    Повертає кількість заархівованих транзакцій.
+    """
+    if settings['retention_days'] <= 0:
+        return 0
+    
+    # Транзакції з вікна запиту виписки лишаються в базі, інакше наступна синхронізація вважала б їх новими
+    retention_days = max(settings['retention_days'], settings['days_to_fetch'] + 1)
+    cutoff = (now_ts or int(time.time())) - retention_days * 86400
+    archive_dir = Path(settings['archive_dir'])
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    
+    archived = 0
+    while True:
+        rows = conn.execute(ARCHIVE_SELECT_SQL, (cutoff, ARCHIVE_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        
+        months = {}
+        for row in rows:
+            month = datetime.fromtimestamp(row['time'], KYIV_TZ).strftime('%Y-%m')
+            months.setdefault(month, []).append(dict(row))
+        
+        # Спочатку архів на диску, потім видалення з бази: після збою рядок може
+        # потрапити в архів двічі, але не загубитися
+        for month, month_rows in months.items():
+            write_archive(archive_path(archive_dir, month), month_rows)
+        
+        with metrics.timer('db_write_seconds', operation='archive'):
+            for chunk, placeholders in id_chunks([row['id'] for row in rows]):
+                for sql in ARCHIVE_DELETE_SQL:
+                    conn.execute(sql.format(placeholders=placeholders), chunk)
+            conn.commit()
+        
+        archived += len(rows)
+        logger.debug("Заархівовано %d транзакцій за %s", len(rows), ", ".join(sorted(months)))
+    
+    metrics.inc('transactions_archived_total', archived)
+    if archived:
+        logger.info(f"Заархівовано транзакцій старших за {retention_days} днів: {archived}")
+    return archived
+
+def compact_db(conn):
+    """Повернути вільні сторінки файловій системі та оновити статистику для планувальника запитів"""
+    conn.commit()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Режим auto_vacuum старої бази змінюється лише повним VACUUM - один раз
+        logger.info("Переведення бази в режим incremental auto_vacuum (повний VACUUM)")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # Прагма звільняє по сторінці на крок; executescript виконує її до кінця, execute - лише один крок
+        conn.executescript("PRAGMA incremental_vacuum;")
+    
+    # Статистика за вибіркою рядків, щоб ANALYZE не читав усю таблицю
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def db_size(conn):
+    """Розмір файлу бази і розмір вільних сторінок у байтах"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size * page_count, page_size * freelist
+
+def run_maintenance(conn, settings):
+    """Архівація старих транзакцій, incremental VACUUM і ANALYZE"""
+    started = time.perf_counter()
+    size_before, _ = db_size(conn)
+    
+    archived = archive_transactions(conn, settings)
+    compact_db(conn)
+    
+    size_after, _ = db_size(conn)
+    details = {"archived": archived, "size_before": size_before, "size_after": size_after}
+    conn.execute(MAINTENANCE_SAVE_SQL, ('maintenance', int(time.time()), json.dumps(details)))
+    conn.commit()
+    metrics.set('db_size_bytes', size_after)
+    
+    logger.info(
+        f"Обслуговування бази за {time.perf_counter() - started:.1f} с: заархівовано {archived}, "
+        f"розмір {size_before / 1048576:.1f} -> {size_after / 1048576:.1f} МБ",
+        extra=SUMMARY
+    )
+    return archived
+
+def run_maintenance_if_due(conn, settings):
+    """Обслуговування раз на MAINTENANCE_INTERVAL секунд (час зберігається в базі, тож працює і з cron)"""
+    if settings['maintenance_interval'] <= 0:
+        return
+    try:
+        row = conn.execute(MAINTENANCE_SELECT_SQL, ('maintenance',)).fetchone()
+        if row is None or row['last_run'] + settings['maintenance_interval'] <= time.time():
+            run_maintenance(conn, settings)
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Помилка обслуговування бази: {e}", exc_info=True)
+
+def run_maintenance_in_thread(settings):
+    """run_maintenance_if_due() з власним з'єднанням для виклику з іншого потоку"""
+    conn = open_db(settings['db_file'])
+    try:
+        run_maintenance_if_due(conn, settings)
+    finally:
+        conn.close()
+
+def print_db_stats(conn, settings):
+    """Розмір бази, вільне місце, рядки і розмір кожної таблиці, архіви"""
+    size, free = db_size(conn)
+    wal = Path(f"{settings['db_file']}-wal")
+    print(
+        f"{settings['db_file']}\t{size / 1048576:.1f} МБ\tвільно: {free / 1048576:.1f} МБ\t"
+        f"WAL: {(wal.stat().st_size if wal.exists() else 0) / 1048576:.1f} МБ"
+    )
+    
+    # dbstat є не в кожній збірці SQLite, тоді показуємо лише кількість рядків
+    try:
+        table_sizes = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:
+        table_sizes = {}
+    
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    for table in tables:
+        rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        table_size = f"\t{table_sizes[table] / 1048576:.1f} МБ" if table in table_sizes else ""
+        print(f"{table}\tрядків: {rows}{table_size}")
+    
+    archives = sorted(Path(settings['archive_dir']).glob("transactions-*.jsonl.gz"))
+    if archives:
+        total = sum(path.stat().st_size for path in archives)
+        print(f"архів {settings['archive_dir']}\tфайлів: {len(archives)}\t{total / 1048576:.1f} МБ\t{archives[0].name} .. {archives[-1].name}")
+    
+    row = conn.execute(MAINTENANCE_SELECT_SQL, ('maintenance',)).fetchone()
+    if row is not None:
+        print(f"останнє обслуговування: {format_kyiv_time(row['last_run'])}\t{row['details']}")
+
+# Групування звіту: (розріз зведень, ключ рядка)
+ROLLUP_GROUPS = {
+    "total": ("total", "'усього'"),
+    "account": ("total", "account_id"),
+    "mcc": ("mcc", "key"),
+    "counterparty": ("counterparty", "key"),
+    "day": ("total", "period"),
+    "month": ("total", "substr(period, 1, 7)"),
+}
+
+ROLLUP_QUERY_SQL = """
+    SELECT {key} AS key, SUM(income_count) AS income_count, SUM(income_amount) AS income_amount,
+           SUM(expense_count) AS expense_count, SUM(expense_amount) AS expense_amount
+    FROM rollups
+    WHERE dimension = ? AND ({periods}){accounts}
+    GROUP BY 1
+    ORDER BY {order}
+"""
+
+def rollup_periods(date_from, date_to):
+    """Періоди зведень, що покривають [date_from, date_to]: цілі місяці - місячні рядки, краї - денні"""
+    months = []
+    days = []
+    day = date_from
+    while day <= date_to:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if day.day == 1 and next_month - timedelta(days=1) <= date_to:
+            months.append(day.strftime('%Y-%m'))
+            day = next_month
+        else:
+            days.append(day.isoformat())
+            day += timedelta(days=1)
+    return months, days
+
+def query_rollups(conn, date_from, date_to, by="total", account_id=None, client_id=None):
+    """Суми надходжень і витрат за період лише зі зведень, без читання транзакцій"""
+    dimension, key = ROLLUP_GROUPS[by]
+    params = [dimension]
+    
+    if by == 'day':
+        # Денні рядки за весь період - діапазоном, щоб не впертися в ліміт параметрів
+        periods = "length(period) = 10 AND period BETWEEN ? AND ?"
+        params += [date_from.isoformat(), date_to.isoformat()]
+    else:
+        months, days = rollup_periods(date_from, date_to)
+        periods = f"period IN ({','.join('?' * len(months + days))})" if months or days else "0"
+        params += months + days
+    
+    accounts = ""
+    if account_id:
+        accounts = " AND account_id = ?"
+        params.append(account_id)
+    elif client_id:
+        accounts = " AND account_id IN (SELECT id FROM accounts WHERE client_id = ?)"
+        params.append(client_id)
+    
+    order = "key" if by in ('day', 'month') else "income_amount DESC, expense_amount DESC"
+    sql = ROLLUP_QUERY_SQL.format(key=key, periods=periods, accounts=accounts, order=order)
+    return [dict(row) for row in conn.execute(sql, params)]
+
+def parse_report_period(date_from, date_to):
+    """Межі звіту з рядків YYYY-MM-DD (за замовчуванням - поточний місяць)"""
+    today = datetime.now(KYIV_TZ).date()
+    start = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else today.replace(day=1)
+    end = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else today
+    if end < start:
+        raise ValueError("Кінець періоду раніше за початок")
+    return start, end
+
+def print_report(conn, args):
+    """Звіт за період у консоль: надходження, витрати і різниця по групах"""
+    date_from, date_to = parse_report_period(args.date_from, args.date_to)
+    rows = query_rollups(conn, date_from, date_to, args.by, args.account, args.client)
+    
+    print(f"{date_from.isoformat()} .. {date_to.isoformat()}")
+    for row in rows:
+        print(
+            f"{row['key']}\tнадходжень: {row['income_count']} на {format_money(row['income_amount'])} грн\t"
+            f"витрат: {row['expense_count']} на {format_money(row['expense_amount'])} грн\t"
+            f"різниця: {format_money(row['income_amount'] - row['expense_amount'])} грн"
+        )
+
+EXPORT_TRANSACTIONS_SQL = """
+    SELECT rowid, id, account_id, time, description, mcc, amount, operation_amount,
+           currency_code, balance, counter_name, comment, created_at
+    FROM transactions
+    WHERE rowid > ?
+    ORDER BY rowid
+"""
+
+# Скільки файлів розділів тримати відкритими одночасно; найдавніше використаний закривається
+EXPORT_MAX_OPEN_FILES = 64
+
+EXPORT_PROGRESS_SELECT_SQL = "SELECT last_rowid, exported FROM export_progress WHERE target = ?"
+
+EXPORT_PROGRESS_SAVE_SQL = "INSERT OR REPLACE INTO export_progress VALUES (?, ?, ?, ?)"
+
+EXPORT_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+def export_schemas():
+    """Схеми колонкових файлів: суми в копійках, time - секунди UTC"""
+    import pyarrow as pa
+    
+    transactions = pa.schema([
+        ("id", pa.string()),
+        ("account_id", pa.string()),
+        ("time", pa.timestamp("s", tz="UTC")),
+        ("description", pa.string()),
+        ("mcc", pa.int32()),
+        ("amount", pa.int64()),
+        ("operation_amount", pa.int64()),
+        ("currency_code", pa.int32()),
+        ("balance", pa.int64()),
+        ("counter_name", pa.string()),
+        ("comment", pa.string()),
+        ("created_at", pa.string()),
+    ])
+    accounts = pa.schema([
+        ("id", pa.string()),
+        ("client_id", pa.string()),
+        ("type", pa.string()),
+        ("currency_code", pa.int32()),
+        ("iban", pa.string()),
+        ("balance", pa.int64()),
+        ("credit_limit", pa.int64()),
+        ("updated_at", pa.string()),
+    ])
+    return transactions, accounts
+
+def open_export_writer(path, schema, export_format):
+    import pyarrow.ipc
+    import pyarrow.parquet
+    
+    if export_format == 'arrow':
+        # Нестиснутий Arrow IPC читається через memory map без копіювання
+        return pyarrow.ipc.new_file(str(path), schema)
+    return pyarrow.parquet.ParquetWriter(str(path), schema, compression="zstd")
+
+def export_tmp_path(path):
+    # Файли з крапкою на початку наборами даних Arrow, DuckDB і Spark не читаються
+    return path.with_name(f".{path.name}.tmp")
+
+def write_export_table(path, table, export_format):
+    """Записати таблицю цілком через тимчасовий файл, щоб читачі не бачили напівзаписаного"""
+    tmp_path = export_tmp_path(path)
+    writer = open_export_writer(tmp_path, table.schema, export_format)
+    writer.write_table(table)
+    writer.close()
+    os.replace(tmp_path, path)
+
+def export_transactions(conn, settings, export_dir=None, export_format=None, full=False):
+    """Дописати в колонкові файли транзакції, збережені після попереднього експорту
+    
+    Файли розбиваються на каталоги month=YYYY-MM/account=<id>/ (розбиття Hive) і
+    читаються як один набір даних. Кожен запуск додає файл part-<rowid> у кожен
+    розділ, де з'явились нові рядки (кілька, якщо файл розділу довелось закрити раніше).
+    Повертає кількість вивантажених транзакцій.
+    """
+    import pyarrow as pa
+    
+    export_dir = Path(export_dir or settings['export_dir'])
+    export_format = export_format or settings['export_format']
+    extension = EXPORT_EXTENSIONS[export_format]
+    transactions_schema, accounts_schema = export_schemas()
+    target = f"{export_dir.resolve()}:{export_format}"
+    
+    progress = conn.execute(EXPORT_PROGRESS_SELECT_SQL, (target,)).fetchone()
+    last_rowid = 0 if full or progress is None else progress['last_rowid']
+    exported = 0 if full or progress is None else progress['exported']
+    if full:
+        import shutil
+        
+        shutil.rmtree(export_dir / "transactions", ignore_errors=True)
+    
+    # Рахунки невеликі - щоразу повний знімок
+    accounts = [dict(row) for row in conn.execute(
+        "SELECT id, client_id, type, currency_code, iban, balance, credit_limit, updated_at FROM accounts"
+    )]
+    export_dir.mkdir(parents=True, exist_ok=True)
+    write_export_table(
+        export_dir / f"accounts.{extension}", pa.Table.from_pylist(accounts, schema=accounts_schema), export_format
+    )
+    
+    # Читання одним знімком WAL: рядки, що з'являться під час експорту, підуть у наступний
+    conn.commit()
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute("BEGIN")
+    c.execute(EXPORT_TRANSACTIONS_SQL, (last_rowid,))
+    
+    # Рядки йдуть за rowid упереміш по розділах, тож вони накопичуються в буферах розділів
+    # (разом не більше EXPORT_CHUNK_SIZE) і записуються великими групами рядків, а відкритих
+    # файлів не більше EXPORT_MAX_OPEN_FILES
+    buffers = {}
+    buffered = 0
+    writers = {}
+    parts = []
+    
+    def flush_partition(key):
+        partition_rows = buffers.pop(key)
+        writer = writers.pop(key, None)
+        if writer is None:
+            if len(writers) >= EXPORT_MAX_OPEN_FILES:
+                writers.pop(next(iter(writers))).close()
+            # Ім'я від першого rowid: повтор після збою перезаписує той самий файл, а не дублює
+            month, account_id = key
+            directory = export_dir / "transactions" / f"month={month}" / f"account={account_id}"
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"part-{partition_rows[0][0]:012d}.{extension}"
+            tmp_path = export_tmp_path(path)
+            writer = open_export_writer(tmp_path, transactions_schema, export_format)
+            parts.append((tmp_path, path))
+        
+        columns = list(zip(*partition_rows))[1:]
+        writer.write_batch(
+            pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, transactions_schema)], schema=transactions_schema)
+        )
+        # Останній використаний - в кінець порядку витіснення
+        writers[key] = writer
+        return len(partition_rows)
+    
+    count = 0
+    try:
+        while True:
+            rows = c.fetchmany(settings['export_chunk_size'])
+            if not rows:
+                break
+            
+            for row in rows:
+                month = datetime.fromtimestamp(row[3], KYIV_TZ).strftime('%Y-%m')
+                buffers.setdefault((month, row[2]), []).append(row)
+            buffered += len(rows)
+            
+            while buffered > settings['export_chunk_size']:
+                buffered -= flush_partition(max(buffers, key=lambda key: len(buffers[key])))
+            
+            count += len(rows)
+            last_rowid = rows[-1][0]
+            logger.debug("Експорт: %d транзакцій, rowid до %d", count, last_rowid)
+        
+        for key in list(buffers):
+            flush_partition(key)
+    finally:
+        conn.rollback()
+        for writer in writers.values():
+            writer.close()
+    
+    # Закриті файли публікуються лише наприкінці, тож після збою читачі бачать попередній стан
+    for tmp_path, path in parts:
+        os.replace(tmp_path, path)
+    
+    # Прогрес зберігається лише після того, як усі файли на місці
+    conn.execute(EXPORT_PROGRESS_SAVE_SQL, (target, last_rowid, exported + count, datetime.now(KYIV_TZ).isoformat()))
+    conn.commit()
+    
+    logger.info(f"Експортовано {count} нових транзакцій у {export_dir} ({export_format}, файлів: {len(parts)}), усього {exported + count}")
+    return count
+
+# Коли вебхук востаннє позначив кеш клієнтів застарілим через невідомий рахунок
+_webhook_cache_expired = {"at": 0}
+
+def handle_webhook_item(conn, lock, settings, account_id, tx):
+    """Обробити транзакцію, яку Monobank надіслав на вебхук"""
+    logger.debug("Отримано транзакцію %s з вебхука для рахунку %s", tx.get('id', ''), account_id)
+    
+    # Обробники FastAPI працюють у пулі потоків, а з'єднання з базою одне
+    with lock:
+        c = conn.cursor()
+        c.execute("SELECT client_id FROM accounts WHERE id = ?", (account_id,))
+        result = c.fetchone()
+        if not result:
+            # Ендпоінт без автентифікації: за невідомим рахунком не повідомляємо і нічого не зберігаємо.
+            # Справжню транзакцію нового рахунку отримає з виписки наступний цикл звірки
+            logger.warning(f"Рахунок {account_id} ще не відомий, транзакцію {tx.get('id', '')} обробить звірка")
+            
+            # Кеш клієнтів позначаємо застарілим не частіше за ліміт client-info, щоб підроблені
+            # запити не витрачали його на повторні запити
+            now_ts = time.time()
+            if now_ts - _webhook_cache_expired['at'] >= settings['client_info_delay']:
+                _webhook_cache_expired['at'] = now_ts
+                expire_client_cache(conn)
+            return
+        
+        client = get_client_configs(conn).get(result[0], {})
+        client_settings = get_client_settings(settings, client)
+        client_name = client.get('name') or "Клієнт Monobank"
+        
+        try:
+            handle_statement_item(conn, account_id, tx, client_name, client_settings)
+        except Exception as e:
+            logger.error(f"Помилка обробки транзакції з вебхука: {e}", exc_info=True)
+
+def create_webhook_app(conn, lock, settings):
+    """FastAPI-застосунок, що приймає StatementItem від Monobank"""
+    from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+    from fastapi.responses import PlainTextResponse
+    
+    app = FastAPI(title="MonoMonitor webhook")
+    
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def get_metrics():
+        return metrics.render()
+    
+    # Звіти містять фінансові дані, тож доступні лише з REPORTS_TOKEN
+    if settings['reports_token']:
+        @app.get("/reports")
+        def get_report(request: Request, by: str = "total", account: str = None, client: str = None):
+            if request.headers.get('authorization') != f"Bearer {settings['reports_token']}":
+                raise HTTPException(status_code=401)
+            if by not in ROLLUP_GROUPS:
+                raise HTTPException(status_code=400, detail=f"by: {', '.join(ROLLUP_GROUPS)}")
+            try:
+                date_from, date_to = parse_report_period(request.query_params.get('from'), request.query_params.get('to'))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            with lock:
+                rows = query_rollups(conn, date_from, date_to, by, account, client)
+            return {"from": date_from.isoformat(), "to": date_to.isoformat(), "by": by, "rows": rows}
+    
+    # Monobank перевіряє вебхук GET-запитом під час реєстрації
+    @app.get(settings['webhook_path'])
+    def verify_webhook():
+        return {"status": "ok"}
+    
+    @app.post(settings['webhook_path'])
+    async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
+        try:
+            payload = await request.json()
+        except ValueError:
+            logger.warning("Вебхук отримав некоректний JSON")
+            return {"status": "ignored"}
+        
+        if not isinstance(payload, dict) or payload.get('type') != 'StatementItem':
+            return {"status": "ignored"}
+        
+        # Ендпоінт публічний: тіло з іншою структурою ігноруємо, а не відповідаємо 500
+        data = payload.get('data')
+        item = data.get('statementItem') if isinstance(data, dict) else None
+        if (
+            not isinstance(item, dict) or not isinstance(item.get('id'), str) or not item['id']
+            or not isinstance(data.get('account'), str) or not data['account']
+        ):
+            logger.warning("Вебхук отримав дані некоректної структури")
+            return {"status": "ignored"}
+        
+        # Відповідаємо одразу, щоб Monobank не повторював запит, а обробляємо після відповіді
+        background_tasks.add_task(handle_webhook_item, conn, lock, settings, data['account'], item)
+        return {"status": "ok"}
+    
+    return app
+
+def run_webhook_server(runtime, host, port):
+    """Режим вебхука: прийом транзакцій від Monobank і рідкісна звірка опитуванням"""
+    import uvicorn
+    
+    settings = runtime['settings']
+    if not settings['webhook_url']:
+        logger.warning("WEBHOOK_URL не задано, вебхук не буде зареєстровано в Monobank")
+    
+    # Окреме з'єднання для обробників вебхука, щоб не ділити його з потоком звірки
+    webhook_conn = open_db(settings['db_file'])
+    app = create_webhook_app(webhook_conn, threading.Lock(), settings)
+    
+    # Звірка опитуванням у фоновому потоці підхоплює те, що могло не дійти через вебхук
+    logger.info(f"Звірка опитуванням кожні {settings['reconcile_interval']} секунд")
+    reconcile_thread = threading.Thread(
+        target=run_scheduler,
+        args=(runtime, settings['reconcile_interval']),
+        name="reconcile",
+        daemon=True
+    )
+    reconcile_thread.start()
+    
+    try:
+        logger.info(f"Запуск вебхука на {host}:{port}{settings['webhook_path']}")
+        uvicorn.run(app, host=host, port=port)
+    finally:
+        runtime['stop_event'].set()
+        reconcile_thread.join()
+        webhook_conn.close()
+        logger.info("Вебхук зупинено")
+
+async def wait_or_stop_async(seconds, stop_event=None):
+    """Асинхронне очікування; ShutdownRequested, якщо під час нього прийшов сигнал зупинки"""
+    import asyncio
+    
+    if seconds <= 0:
+        return
+    if stop_event is None:
+        await asyncio.sleep(seconds)
+        return
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        return
+    raise ShutdownRequested()
+
+async def api_request_async(api, endpoint, path):
+    """Асинхронний запит до Monobank API через той самий планувальник лімітів"""
+    bucket = api['limits'][endpoint]
+    url = f"{api['base_url']}{path}"
+    headers = {'X-Token': api['token']}
+    
+    for attempt in range(api['max_retries'] + 1):
+        delay = bucket.reserve()
+        if delay > 0:
+            logger.info(f"Очікування {delay:.1f} секунд до дозволеного запиту {endpoint}")
+            await wait_or_stop_async(delay, api['stop_event'])
+        
+        with metrics.timer('api_request_seconds', endpoint=endpoint):
+            response = await api['session'].get(url, headers=headers)
+        if response.status_code != 429:
+            return response
+        
+        metrics.inc('api_rate_limited_total', endpoint=endpoint)
+        if attempt < api['max_retries']:
+            metrics.inc('api_retries_total', endpoint=endpoint)
+        retry_after = get_retry_after(response, attempt, api['backoff'])
+        logger.warning(f"Перевищено ліміт запитів {endpoint} (429), повтор через {retry_after:.1f} секунд")
+        bucket.block(retry_after)
+    
+    return response
+
+async def get_client_info_async(api):
+    response = await api_request_async(api, 'client_info', '/personal/client-info')
+    if response.status_code != 200:
+        logger.error(f"Помилка API: {response.status_code}, {response.text}")
+        raise Exception(f"API error: {response.status_code}, {response.text}")
+    
+    client_data = response.json()
+    logger.info(f"Отримано дані клієнта: {client_data.get('name', 'Невідомий')}, рахунків: {len(client_data.get('accounts', []))}")
+    return client_data
+
+async def get_statements_async(api, account_id, from_ts, to_ts, fingerprint=None):
+    """Асинхронний аналог fetch_statements: (транзакції або None без змін, відбиток)"""
+    digest = hashlib.sha256()
+    statements = {}
+    page_to = to_ts
+    while page_to >= from_ts:
+        page_from = statement_window_start(from_ts, page_to)
+        response = await api_request_async(api, 'statement', f'/personal/statement/{account_id}/{page_from}/{page_to}')
+        if response.status_code != 200:
+            logger.error(f"Помилка API при отриманні виписки: {response.status_code}, {response.text}")
+            raise Exception(f"API error: {response.status_code}, {response.text}")
+        
+        digest.update(response.content)
+        if page_from == from_ts and not statements and digest.hexdigest() == fingerprint:
+            return None, fingerprint
+        
+        page = response.json()
+        for tx in page:
+            statements.setdefault(tx.get('id', ''), tx)
+        page_to = statement_page_end(page, page_from, page_to)
+    
+    if digest.hexdigest() == fingerprint:
+        return None, fingerprint
+    
+    logger.info(f"Отримано {len(statements)} транзакцій для рахунку {account_id}")
+    return list(statements.values()), digest.hexdigest()
+
+async def save_transactions_async(db, account_id, transactions, ignored=()):
+    """Асинхронний аналог save_transactions: сторінка виписки однією транзакцією БД"""
+    if not transactions and not ignored:
+        return set()
+    
+    now = datetime.now(KYIV_TZ).isoformat()
+    with metrics.timer('db_write_seconds', operation='transactions'):
+        await db.executemany(INSERT_HISTORY_SQL, transaction_rows(account_id, ignored, now))
+        await db.executemany(INSERT_TRANSACTION_SQL, transaction_rows(account_id, transactions, now))
+        
+        pending = set()
+        for chunk, placeholders in id_chunks([tx.get('id', '') for tx in transactions]):
+            await db.execute(ENQUEUE_OUTBOX_SQL.format(placeholders=placeholders), chunk)
+            async with db.execute(SELECT_OUTBOX_IDS_SQL.format(placeholders=placeholders), chunk) as c:
+                pending.update(row[0] for row in await c.fetchall())
+        
+        await db.commit()
+    
+    logger.info(f"Збережено {len(transactions)} транзакцій рахунку {account_id}, до відправки {len(pending)}")
+    return pending
+
+async def load_client_info_async(db, api, settings):
+    """Дані клієнта з кешу або з API; незмінений вміст не переписується"""
+    token_hash = token_digest(api['token'])
+    now_ts = int(time.time())
+    async with db.execute(CLIENT_CACHE_SQL, (token_hash,)) as c:
+        row = await c.fetchone()
+    
+    if settings['client_info_ttl'] > 0:
+        client_data = parse_client_cache(row, now_ts, settings['client_info_ttl'])
+        if client_data is not None:
+            logger.info(f"Дані клієнта {client_data.get('name', 'Невідомий')} взято з кешу")
+            return client_data
+    
+    client_data = await get_client_info_async(api)
+    content_hash = client_data_hash(client_data)
+    client_id = client_data.get('clientId', '')
+    
+    async with db.execute("SELECT content_hash FROM clients WHERE client_id = ?", (client_id,)) as c:
+        result = await c.fetchone()
+    if result and result['content_hash'] == content_hash:
+        await db.execute(TOUCH_CLIENT_SQL, (token_hash, now_ts, client_id))
+    else:
+        now = datetime.now(KYIV_TZ).isoformat()
+        await db.execute(SAVE_CLIENT_SQL, client_row(client_data, now, content_hash, token_hash, now_ts))
+        await db.executemany(SAVE_ACCOUNT_SQL, account_rows(client_data, now))
+    await db.commit()
+    return client_data
+
+async def get_client_configs_async(db):
+    async with db.execute(CLIENT_CONFIGS_SQL) as c:
+        return {row['client_id']: dict(row) for row in await c.fetchall()}
+
+def enqueue_notification(pipeline, tx, client_name, settings):
+    """Поставити транзакцію на відправку, не блокуючи опитування API
+    
+    Якщо черга відправки заповнена (повільний SMTP), транзакція лишається в outbox
+    і буде підхоплена наступним проходом по outbox. Повертає False лише в цьому випадку.
+    """
+    import asyncio
+    
+    tx_id = tx.get('id', '')
+    if tx_id in pipeline['queued'] or settings['notify_mode'] == 'digest':
+        return True
+    
+    try:
+        pipeline['notify_queue'].put_nowait((tx, client_name, settings))
+    except asyncio.QueueFull:
+        logger.debug("Черга відправки заповнена, транзакція %s лишається в outbox", tx_id)
+        return False
+    pipeline['queued'].add(tx_id)
+    return True
+
+async def enqueue_pending_async(pipeline):
+    """Поставити на відправку транзакції, що накопичились в outbox
+    
+    Читається не більше, ніж вміщує черга відправки (плюс уже поставлені в неї), тож великий
+    беклог розбирається частинами за кілька проходів, а не перечитується щоразу цілком.
+    """
+    db = pipeline['db']
+    notify_queue = pipeline['notify_queue']
+    limit = -1
+    if notify_queue.maxsize > 0:
+        free = notify_queue.maxsize - notify_queue.qsize()
+        if free <= 0:
+            logger.info("Черга відправки заповнена, outbox не читається до наступного проходу")
+            return
+        limit = free + len(pipeline['queued'])
+    
+    async with db.execute(PENDING_OUTBOX_SQL + " LIMIT ?", (limit,)) as c:
+        transactions = [dict(row) for row in await c.fetchall()]
+    
+    logger.info(f"Прочитано {len(transactions)} невідправлених транзакцій з outbox")
+    
+    clients = await get_client_configs_async(db)
+    overflow = 0
+    for tx in transactions:
+        client = clients.get(tx['client_id'], {})
+        client_settings = get_client_settings(pipeline['settings'], client)
+        
+        if not should_process_transaction(tx, client_settings):
+            # Як remove_from_outbox: більше не чекає відправки, тож оброблена
+            await db.execute(MARK_PROCESSED_SQL, (tx['id'],))
+            await db.execute(DEQUEUE_OUTBOX_SQL, (tx['id'],))
+            continue
+        
+        if not enqueue_notification(pipeline, tx, client.get('name') or "Клієнт Monobank", client_settings):
+            overflow += 1
+    
+    await db.commit()
+    if overflow:
+        logger.warning(f"Черга відправки заповнена, {overflow} транзакцій лишаються в outbox до наступного проходу")
+
+async def acquire_lease_async(db, name, ttl):
+    """Асинхронний acquire_lease для з'єднання конвеєра"""
+    now_ts = int(time.time())
+    async with db.execute(ACQUIRE_LEASE_SQL, (name, INSTANCE_ID, now_ts + ttl, now_ts)) as c:
+        leased = c.rowcount > 0
+    await db.commit()
+    return leased
+
+async def release_lease_async(db, name):
+    await db.execute(RELEASE_LEASE_SQL, (name, INSTANCE_ID))
+    await db.commit()
+
+async def fetch_tenant_async(pipeline, api):
+    """Етап отримання: дані клієнта і виписки його рахунків у чергу збереження"""
+    db = pipeline['db']
+    client_data = await load_client_info_async(db, api, pipeline['settings'])
+    
+    for account in client_data.get('accounts', []):
+        account_id = account.get('id')
+        if not account_id:
+            continue
+        
+        # Продовжуємо оренду перед кожним рахунком, бо запити виписок чекають на ліміт
+        if not await acquire_lease_async(db, 'sync', pipeline['settings']['sync_lease_ttl']):
+            logger.warning("Оренду синхронізації перехопив інший процес, опитування клієнта перервано")
+            return
+        
+        async with db.execute(SYNC_CURSOR_SELECT_SQL, (account_id,)) as c:
+            cursor = parse_sync_cursor(await c.fetchone())
+        
+        now_ts = int(time.time())
+        statements, fingerprint = await get_statements_async(
+            api, account_id, get_sync_window(cursor, now_ts, pipeline['settings']), now_ts,
+            cursor['fingerprint'] if cursor else None
+        )
+        if statements is None:
+            # Без змін: етап збереження лише зсуне курсор
+            metrics.inc('statements_unchanged_total')
+            logger.info(f"Виписка рахунку {account_id} не змінилась з попереднього опитування")
+            statements = []
+        
+        # Якщо збереження не встигає, отримання чекає тут, а не накопичує виписки в пам'яті
+        await pipeline['statements_queue'].put({
+            "account_id": account_id,
+            "client_id": client_data.get('clientId', ''),
+            "client_name": client_data.get('name', 'Клієнт Monobank'),
+            "cursor": cursor,
+            "statements": statements,
+            "synced_to": now_ts,
+            "fingerprint": fingerprint,
+        })
+
+async def persist_stage_async(pipeline):
+    """Етап збереження: фільтр, пакетний запис, курсор і постановка на відправку"""
+    db = pipeline['db']
+    
+    while True:
+        page = await pipeline['statements_queue'].get()
+        if page is None:
+            break
+        
+        try:
+            clients = await get_client_configs_async(db)
+            client_settings = get_client_settings(pipeline['settings'], clients.get(page['client_id'], {}))
+            
+            statements = skip_seen_statements(page['statements'], page['cursor'])
+            qualifying, ignored = filter_transactions(statements, client_settings, page['account_id'])
+            metrics.inc('transactions_total', len(statements), result='fetched')
+            metrics.inc('transactions_total', len(ignored), result='skipped')
+            
+            pending = await save_transactions_async(db, page['account_id'], qualifying, ignored)
+            await db.execute(
+                SYNC_CURSOR_SAVE_SQL,
+                sync_cursor_row(page['account_id'], page['cursor'], statements, page['synced_to'], page['fingerprint'])
+            )
+            await db.commit()
+            
+            overflow = 0
+            for tx in qualifying:
+                if tx.get('id', '') in pending:
+                    tx['account_id'] = page['account_id']
+                    if not enqueue_notification(pipeline, tx, page['client_name'], client_settings):
+                        overflow += 1
+            if overflow:
+                logger.warning(f"Черга відправки заповнена, {overflow} транзакцій рахунку {page['account_id']} лишаються в outbox")
+        except Exception as e:
+            logger.error(f"Помилка збереження виписки рахунку {page['account_id']}: {e}", exc_info=True)
+        finally:
+            pipeline['statements_queue'].task_done()
+
+async def record_delivery_failure_async(db, transaction_id, error, settings):
+    """Асинхронний аналог record_delivery_failure"""
+    async with db.execute(OUTBOX_ATTEMPTS_SQL, (transaction_id,)) as c:
+        result = await c.fetchone()
+    if result is None:
+        return
+    
+    attempts = (result['attempts'] or 0) + 1
+    dead, next_attempt = retry_schedule(attempts, settings)
+    await db.execute(RETRY_OUTBOX_SQL, (attempts, next_attempt, error, dead, transaction_id))
+    await db.commit()
+    log_delivery_failure(transaction_id, attempts, dead, next_attempt)
+
+async def notify_stage_async(pipeline):
+    """Етап відправки: усі канали транзакції одночасно і позначка обробленої транзакції"""
+    import asyncio
+    import aiosmtplib
+    
+    db = pipeline['db']
+    
+    # Кожен обробник тримає власне автентифіковане з'єднання між листами
+    smtp = None
+    smtp_key = None
+    smtp_sent = 0
+    
+    async def close_smtp():
+        nonlocal smtp
+        if smtp is not None:
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                smtp.close()
+            smtp = None
+    
+    async def send_email(tx, client_name, settings):
+        nonlocal smtp, smtp_key, smtp_sent
+        key = (settings['smtp_server'], settings['smtp_port'], settings['smtp_username'])
+        try:
+            msg = build_transaction_email(tx, client_name, settings)
+            if smtp is not None and (key != smtp_key or smtp_sent >= settings['smtp_max_messages']):
+                await close_smtp()
+            
+            send_started = time.perf_counter()
+            for attempt in range(2):
+                if smtp is None:
+                    client = aiosmtplib.SMTP(
+                        hostname=settings['smtp_server'],
+                        port=settings['smtp_port'],
+                        start_tls=settings['smtp_starttls'],
+                        timeout=settings['smtp_timeout']
+                    )
+                    await client.connect()
+                    if settings['smtp_username']:
+                        try:
+                            await client.login(settings['smtp_username'], settings['smtp_password'])
+                        except Exception:
+                            client.close()
+                            raise
+                    smtp = client
+                    smtp_key = key
+                    smtp_sent = 0
+                try:
+                    await smtp.send_message(msg)
+                    smtp_sent += 1
+                    break
+                except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPResponseException, OSError) as e:
+                    # Відмову прийняти лист перепідключення не виправить (див. SmtpConnection.send)
+                    if isinstance(e, aiosmtplib.SMTPResponseException) and e.code != 421:
+                        raise
+                    
+                    # Сервер закрив простояне з'єднання - один раз перепідключаємось
+                    smtp.close()
+                    smtp = None
+                    if attempt:
+                        raise
+                    metrics.inc('smtp_reconnects_total')
+        except Exception:
+            metrics.inc('emails_total', result='failed')
+            raise
+        metrics.observe('smtp_send_seconds', time.perf_counter() - send_started)
+        metrics.inc('emails_total', result='sent')
+        observe_delivery([tx])
+    
+    while True:
+        item = await pipeline['notify_queue'].get()
+        if item is None:
+            break
+        
+        tx, client_name, settings = item
+        tx_id = tx.get('id', '')
+        claim_id = new_claim_id()
+        try:
+            # Захоплюємо транзакцію, щоб її одночасно не відправив інший процес
+            now_ts = int(time.time())
+            async with db.execute(
+                CLAIM_OUTBOX_SQL.format(placeholders='?'),
+                (claim_id, now_ts, tx_id, now_ts, now_ts - settings['claim_lease'])
+            ) as c:
+                claimed = c.rowcount > 0
+            await db.commit()
+            if not claimed:
+                logger.debug("Транзакцію %s вже відправляє інший обробник", tx_id)
+                continue
+            
+            async with db.execute(SENT_CHANNELS_SQL.format(placeholders='?'), (tx_id,)) as c:
+                sent = {row[1] for row in await c.fetchall()}
+            notifiers = [notifier for notifier in get_notifiers(settings) if notifier.channel not in sent]
+            
+            # Канали працюють одночасно, тож повільний канал не затримує інші
+            results = await asyncio.gather(
+                *(
+                    send_email(tx, client_name, settings) if notifier.channel == 'smtp'
+                    else notifier.send_async(item)
+                    for notifier in notifiers
+                ),
+                return_exceptions=True
+            )
+            
+            errors = []
+            for notifier, result in zip(notifiers, results):
+                error = str(result) if isinstance(result, Exception) else None
+                await db.execute(DELIVERY_SAVE_SQL, delivery_row(tx_id, notifier.channel, error))
+                metrics.inc('notifications_total', channel=notifier.channel, result='sent' if error is None else 'failed')
+                if error is not None:
+                    errors.append(f"{notifier.channel}: {error}")
+            await db.commit()
+            if errors:
+                raise Exception("; ".join(errors))
+            
+            with metrics.timer('db_write_seconds', operation='mark_processed'):
+                await db.execute(MARK_PROCESSED_SQL, (tx_id,))
+                await db.execute(DEQUEUE_OUTBOX_SQL, (tx_id,))
+                await db.commit()
+            logger.debug("Успішно відправлено повідомлення для транзакції %s", tx_id)
+        except Exception as e:
+            logger.error(f"Помилка відправки повідомлення для транзакції {tx_id}: {e}")
+            await record_delivery_failure_async(db, tx_id, str(e), settings)
+        finally:
+            await db.execute(RELEASE_OUTBOX_SQL, (claim_id,))
+            await db.commit()
+            pipeline['queued'].discard(tx_id)
+    
+    await close_smtp()
+
+async def poll_async(pipeline):
+    """Один прохід опитування: outbox і виписки всіх клієнтів одночасно"""
+    import asyncio
+    
+    db = pipeline['db']
+    settings = pipeline['settings']
+    
+    if not await acquire_lease_async(db, 'sync', settings['sync_lease_ttl']):
+        logger.info("Синхронізацію зараз виконує інший процес, прохід пропущено", extra=SUMMARY)
+        return
+    
+    # Оренда звільняється і після помилки чи сигналу зупинки, інакше інші процеси чекали б SYNC_LEASE_TTL
+    try:
+        logger.info(f"============= ПОЧАТОК РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============")
+        
+        await enqueue_pending_async(pipeline)
+        
+        async with db.execute(TENANT_TOKENS_SQL) as c:
+            tokens = merge_tenant_tokens(settings, [row[0] for row in await c.fetchall()])
+        
+        apis = []
+        for token in tokens:
+            if token not in pipeline['apis']:
+                pipeline['apis'][token] = create_api_client(
+                    pipeline['http'], token, settings, pipeline['stop_event']
+                )
+            apis.append(pipeline['apis'][token])
+        
+        # Кожен токен має власні ліміти, тож клієнти опитуються паралельно в одному циклі подій
+        results = await asyncio.gather(
+            *(fetch_tenant_async(pipeline, api) for api in apis),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, ShutdownRequested):
+                raise result
+            if isinstance(result, Exception):
+                logger.error(f"Помилка опитування клієнта: {result}")
+        
+        # Зведення відправляються синхронним кодом в окремому потоці, щоб не блокувати цикл подій
+        if settings['notify_mode'] == 'digest':
+            await pipeline['statements_queue'].join()
+            await asyncio.to_thread(flush_digests_in_thread, settings)
+        
+        # Обслуговування бази теж синхронне, в окремому потоці з власним з'єднанням
+        await asyncio.to_thread(run_maintenance_in_thread, settings)
+    finally:
+        await release_lease_async(db, 'sync')
+    
+    async with db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0") as c:
+        metrics.set('outbox_pending', (await c.fetchone())[0])
+    async with db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1") as c:
+        metrics.set('outbox_dead', (await c.fetchone())[0])
+    metrics.set('last_cycle_timestamp_seconds', int(time.time()))
+    
+    logger.info(f"============= КІНЕЦЬ РОБОТИ: {datetime.now(KYIV_TZ).strftime('%d.%m.%Y %H:%M:%S')} (Київський час) =============", extra=SUMMARY)
+
+async def run_async_daemon(settings):
+    """Асинхронний демон: отримання, збереження і відправка як окремі етапи з обмеженими чергами"""
+    import asyncio
+    import aiosqlite
+    import httpx
+    
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_event.set)
+    
+    db = await aiosqlite.connect(settings['db_file'], timeout=30)
+    db.row_factory = sqlite3.Row
+    await db.execute("PRAGMA journal_mode = WAL")
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.execute("PRAGMA busy_timeout = 30000")
+    
+    pipeline = {
+        "settings": settings,
+        "db": db,
+        "http": httpx.AsyncClient(timeout=30),
+        "stop_event": stop_event,
+        "apis": {},
+        "statements_queue": asyncio.Queue(maxsize=settings['pipeline_queue_size']),
+        "notify_queue": asyncio.Queue(maxsize=settings['pipeline_queue_size']),
+        "queued": set(),
+    }
+    
+    persist_task = asyncio.create_task(persist_stage_async(pipeline))
+    notify_tasks = [
+        asyncio.create_task(notify_stage_async(pipeline))
+        for _ in range(settings['notify_workers'])
+    ]
+    
+    if settings['metrics_port']:
+        start_metrics_server(settings['metrics_host'], settings['metrics_port'])
+    
+    logger.info(f"Запуск асинхронного демона, інтервал опитування {settings['poll_interval']} секунд")
+    
+    try:
+        while not stop_event.is_set():
+            started = loop.time()
+            try:
+                await poll_async(pipeline)
+            except ShutdownRequested:
+                break
+            except Exception as e:
+                logger.error(f"Критична помилка: {e}", exc_info=True)
+            metrics.observe('cycle_seconds', loop.time() - started)
+            
+            try:
+                await wait_or_stop_async(settings['poll_interval'] - (loop.time() - started), stop_event)
+            except ShutdownRequested:
+                break
+    finally:
+        # Дочекатися, поки етапи допрацюють уже отримане
+        await pipeline['statements_queue'].put(None)
+        await persist_task
+        for _ in notify_tasks:
+            await pipeline['notify_queue'].put(None)
+        await asyncio.gather(*notify_tasks)
+        await close_notifiers_async()
+        await pipeline['http'].aclose()
+        await db.close()
+        logger.info("Асинхронний демон зупинено")
+
+def run_client_command(conn, args):
+    """Керування клієнтами: токени, отримувачі та фільтри в таблиці clients"""
+    if args.client_command == 'set':
+        set_client_config(
+            conn,
+            args.client_id,
+            token=args.token,
+            recipients=args.recipients,
+            ignore_senders=args.ignore_senders
+        )
+    else:
+        for client in get_client_configs(conn).values():
+            print(
+                f"{client['client_id']}\t{client['name'] or ''}\t"
+                f"токен: {'так' if client['token'] else 'ні'}\t"
+                f"отримувачі: {client['recipients'] or '(з .env)'}\t"
+                f"фільтри: {client['ignore_senders'] if client['ignore_senders'] is not None else '(з .env)'}"
+            )
+
+def run_outbox_command(conn, args):
+    """Перегляд черги повідомлень і повторна постановка невдалих на відправку"""
+    c = conn.cursor()
+    if args.outbox_command == 'replay':
+        if args.transaction_ids:
+            placeholders = ','.join('?' * len(args.transaction_ids))
+            c.execute(REPLAY_OUTBOX_SQL + f" WHERE transaction_id IN ({placeholders})", args.transaction_ids)
+        elif args.dead:
+            c.execute(REPLAY_OUTBOX_SQL + " WHERE dead = 1")
+        else:
+            c.execute(REPLAY_OUTBOX_SQL + " WHERE attempts > 0")
+        conn.commit()
+        logger.info(f"Повернуто на відправку {c.rowcount} транзакцій")
+        return
+    
+    c.execute("""
+        SELECT o.transaction_id, o.attempts, o.next_attempt, o.dead, o.last_error, o.claimed_by, t.time, t.amount
+        FROM outbox o LEFT JOIN transactions t ON t.id = o.transaction_id
+        WHERE o.dead = ? OR ? = 0
+        ORDER BY o.dead DESC, o.next_attempt
+    """, (1, 1 if args.dead else 0))
+    for row in c.fetchall():
+        state = 'dead' if row['dead'] else (f"наступна спроба {format_kyiv_time(row['next_attempt'])}" if row['attempts'] else 'очікує')
+        if row['claimed_by']:
+            state += f", відправляє {row['claimed_by']}"
+        print(
+            f"{row['transaction_id']}\t{format_kyiv_time(row['time'])}\t{(row['amount'] or 0) / 100:.2f} грн\t"
+            f"спроб: {row['attempts']}\t{state}\t{row['last_error'] or ''}"
+        )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Моніторинг вхідних платежів Monobank")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="працювати постійно з внутрішнім планувальником замість одноразового запуску"
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="разом з --daemon: асинхронний конвеєр (httpx, aiosqlite, aiosmtplib)"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    
+    webhook_parser = subparsers.add_parser("webhook", help="приймати транзакції через вебхук Monobank")
+    webhook_parser.add_argument("--host", help="адреса для прослуховування (WEBHOOK_HOST)")
+    webhook_parser.add_argument("--port", type=int, help="порт для прослуховування (WEBHOOK_PORT)")
+    
+    backfill_parser = subparsers.add_parser("backfill", help="завантажити історію виписок (з продовженням після переривання)")
+    backfill_parser.add_argument("--days", type=int, default=365, help="глибина історії в днях")
+    backfill_parser.add_argument("--restart", action="store_true", help="почати заново, ігноруючи збережений прогрес")
+    backfill_parser.add_argument("--status", action="store_true", help="показати прогрес і вийти")
+    
+    outbox_parser = subparsers.add_parser("outbox", help="черга повідомлень: спроби, dead-letter, повтор")
+    outbox_subparsers = outbox_parser.add_subparsers(dest="outbox_command", required=True)
+    list_outbox_parser = outbox_subparsers.add_parser("list", help="показати транзакції, що чекають на відправку")
+    list_outbox_parser.add_argument("--dead", action="store_true", help="лише dead-letter")
+    replay_parser = outbox_subparsers.add_parser("replay", help="скинути спроби і відправити в наступному циклі")
+    replay_parser.add_argument("transaction_ids", nargs="*", help="ID транзакцій (за замовчуванням усі з невдалими спробами)")
+    replay_parser.add_argument("--dead", action="store_true", help="лише dead-letter")
+    
+    report_parser = subparsers.add_parser("report", help="надходження і витрати за період зі зведень")
+    report_parser.add_argument("--from", dest="date_from", help="початок періоду YYYY-MM-DD (за замовчуванням - початок місяця)")
+    report_parser.add_argument("--to", dest="date_to", help="кінець періоду YYYY-MM-DD включно (за замовчуванням - сьогодні)")
+    report_parser.add_argument("--by", choices=list(ROLLUP_GROUPS), default="total", help="групування")
+    report_parser.add_argument("--account", help="лише один рахунок")
+    report_parser.add_argument("--client", help="лише рахунки клієнта")
+    
+    export_parser = subparsers.add_parser("export", help="дописати нові транзакції в колонкові файли за місяцями і рахунками")
+    export_parser.add_argument("--dir", help="каталог експорту (EXPORT_DIR)")
+    export_parser.add_argument("--format", choices=list(EXPORT_EXTENSIONS), help="parquet або arrow (EXPORT_FORMAT)")
+    export_parser.add_argument("--full", action="store_true", help="вивантажити всю історію заново")
+    
+    db_parser = subparsers.add_parser("db", help="обслуговування бази: розмір, архівація, VACUUM")
+    db_subparsers = db_parser.add_subparsers(dest="db_command", required=True)
+    db_subparsers.add_parser("stats", help="показати розмір бази і кількість рядків у таблицях")
+    db_subparsers.add_parser("maintain", help="заархівувати старі транзакції, виконати VACUUM і ANALYZE зараз")
+    
+    client_parser = subparsers.add_parser("client", help="налаштування клієнтів у мультитенантному режимі")
+    client_subparsers = client_parser.add_subparsers(dest="client_command", required=True)
+    client_subparsers.add_parser("list", help="показати клієнтів і їхні налаштування")
+    set_parser = client_subparsers.add_parser("set", help="задати токен, отримувачів або фільтри клієнта")
+    set_parser.add_argument("client_id")
+    set_parser.add_argument("--token", help="токен Monobank API клієнта")
+    set_parser.add_argument("--recipients", help="отримувачі листів через кому")
+    set_parser.add_argument("--ignore-senders", help="ігноровані відправники через кому")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    
+    # Отримання налаштувань з .env файлу
+    settings = get_settings()
+    
+    # Налаштування логування
+    log_listener = setup_logging(settings)
+    
+    # З'єднання з базою, HTTP-сесія і ліміти запитів живуть весь час роботи процесу
+    runtime = create_runtime(settings)
+    
+    try:
+        # Створюємо базу даних, якщо вона ще не існує
+        create_db(runtime['conn'])
+        
+        if args.command not in ('client', 'backfill', 'outbox', 'db', 'report', 'export'):
+            clients = get_client_configs(runtime['conn'])
+            # Разовий запуск з cron компілює шаблони лише тоді, коли є що відправити
+            if args.daemon or args.command == 'webhook':
+                precompile_templates(settings, clients)
+            precompile_filters(settings, clients)
+        
+        if args.command == 'client':
+            run_client_command(runtime['conn'], args)
+        elif args.command == 'outbox':
+            run_outbox_command(runtime['conn'], args)
+        elif args.command == 'export':
+            export_transactions(runtime['conn'], settings, args.dir, args.format, args.full)
+        elif args.command == 'report':
+            print_report(runtime['conn'], args)
+        elif args.command == 'db' and args.db_command == 'stats':
+            print_db_stats(runtime['conn'], settings)
+        elif args.command == 'db':
+            run_maintenance(runtime['conn'], settings)
+        elif args.command == 'backfill' and args.status:
+            print_backfill_status(runtime['conn'])
+        elif args.command == 'backfill':
+            run_backfill(runtime, args.days, args.restart)
+        elif args.command == 'webhook':
+            run_webhook_server(
+                runtime,
+                args.host or settings['webhook_host'],
+                args.port or settings['webhook_port']
+            )
+        elif args.daemon and args.use_async:
+            import asyncio
+            
+            asyncio.run(run_async_daemon(settings))
+        elif args.daemon:
+            run_daemon(runtime)
+        else:
+            run_cycle(runtime)
+    finally:
+        close_notifiers()
+        runtime['session'].close()
+        runtime['conn'].close()
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file